@@ -0,0 +1,213 @@
+"""
+Offline extraction benchmark over the gzip-compressed product pages in
+benchmarks/fixtures. Reports parse time, extraction time, peak memory and
+field accuracy per page and per platform. Parse time covers the structured
+data scan and, when that misses, building the DOM; the fast-path hit rate is
+shown per platform.
+
+The run fails when an extractor returns a wrong field. Timings depend on the
+machine, so they are only compared with --compare, against a baseline saved
+on the same machine with --save (kept out of git).
+
+    python -m benchmarks.extraction                # run, fail on wrong fields
+    python -m benchmarks.extraction --save         # store this machine's baseline
+    python -m benchmarks.extraction --compare      # also fail on timing or memory regressions
+    python -m benchmarks.extraction --platform amazon --repeat 50 --selectors
+
+The fixtures are synthetic pages written against the current selectors and
+structured data formats. They measure the extractors and catch regressions in
+the code, not changes to the live sites' layouts. To add a page, save it
+gzipped under fixtures/<platform>/ and list it in fixtures/manifest.json with
+the fields the extractor should return.
+"""
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from bs4 import BeautifulSoup as bs
+
+from utils.scrapers import amazon, flipkart, generic
+from utils.scrapers.structured import parse_structured
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(ROOT, "fixtures")
+BASELINE = os.path.join(ROOT, "baseline.local.json")
+
+PAGES = { "amazon": amazon.AmazonPage, "flipkart": flipkart.FlipkartPage, "generic": generic.CommonPage }
+SELECTORS = { "amazon": amazon.SELECTORS, "flipkart": flipkart.SELECTORS, "generic": generic.SELECTORS }
+FIELDS = { "title": "get_title", "price": "get_price", "available": "is_available" }
+
+
+def load_fixtures(platform: str = None) -> list[dict]:
+    with open(os.path.join(FIXTURES, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    fixtures = []
+    for entry in manifest:
+        if platform and entry["platform"] != platform:
+            continue
+        with gzip.open(os.path.join(FIXTURES, entry["page"]), "rt", encoding="utf-8") as f:
+            fixtures.append({ **entry, "html": f.read() })
+    return fixtures
+
+
+def extract(platform: str, html: str, fields) -> tuple[float, float, dict, bool]:
+    start = time.perf_counter()
+    if structured := parse_structured(html):
+        return time.perf_counter() - start, 0.0, { field: getattr(structured, field) for field in fields }, True
+    page = PAGES[platform](bs(html, "lxml"))
+    parsed = time.perf_counter()
+    values = { field: getattr(page, FIELDS[field])() for field in fields }
+    return parsed - start, time.perf_counter() - parsed, values, False
+
+
+def matches(field: str, expected, actual) -> bool:
+    if actual is None:
+        return expected is None
+    if field == "title":
+        return " ".join(str(actual).split()) == expected
+    if field == "price":
+        try:
+            return float(actual) == float(expected)
+        except ValueError:
+            return False
+    return actual == expected
+
+
+# Selector hits over all pages, by platform, field and pattern
+SELECTOR_HITS: dict[tuple[str, str, str], int] = {}
+
+
+def reset_selectors():
+    # Chains reorder themselves by hits, each page starts from the declared order
+    for chains in SELECTORS.values():
+        for chain in chains.values():
+            chain.reset()
+
+
+def tally_selectors():
+    for platform, chains in SELECTORS.items():
+        for field, chain in chains.items():
+            for pattern, hits in chain.stats():
+                SELECTOR_HITS[(platform, field, pattern)] = SELECTOR_HITS.get((platform, field, pattern), 0) + hits
+
+
+def bench_page(fixture: dict, repeat: int) -> dict:
+    platform, html, expected = fixture["platform"], fixture["html"], fixture["expected"]
+    reset_selectors()
+    parse_times, extract_times = [], []
+    for _ in range(repeat):
+        parse_time, extract_time, values, fast = extract(platform, html, expected)
+        parse_times.append(parse_time)
+        extract_times.append(extract_time)
+
+    # Traced separately, tracemalloc slows the timed runs down several times
+    tracemalloc.start()
+    extract(platform, html, expected)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tally_selectors()
+
+    wrong = [field for field, value in expected.items() if not matches(field, value, values[field])]
+    return {
+        "platform": platform,
+        "parse_ms": min(parse_times) * 1000,
+        "extract_ms": min(extract_times) * 1000,
+        "peak_kb": peak / 1024,
+        "accuracy": 1 - len(wrong) / len(expected),
+        "fast": fast,
+        "wrong": wrong,
+    }
+
+
+def summarize(pages: dict) -> dict:
+    platforms = {}
+    for result in pages.values():
+        platforms.setdefault(result["platform"], []).append(result)
+    return {
+        platform: {
+            "parse_ms": sum(r["parse_ms"] for r in results),
+            "extract_ms": sum(r["extract_ms"] for r in results),
+            "peak_kb": max(r["peak_kb"] for r in results),
+            "accuracy": statistics.mean(r["accuracy"] for r in results),
+            "fast": statistics.mean(r["fast"] for r in results),
+        }
+        for platform, results in platforms.items()
+    }
+
+
+def delta(current: float, baseline) -> str:
+    if not baseline:
+        return ""
+    return f" ({(current - baseline) / baseline:+.0%})"
+
+
+def report(name: str, result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Prints one row and returns the metrics that regressed past the tolerance, given a baseline."""
+    print(
+        f"{name:<40} parse {result['parse_ms']:8.2f} ms{delta(result['parse_ms'], baseline.get('parse_ms')):<8}"
+        f" extract {result['extract_ms']:7.2f} ms{delta(result['extract_ms'], baseline.get('extract_ms')):<8}"
+        f" peak {result['peak_kb']:8.0f} KiB{delta(result['peak_kb'], baseline.get('peak_kb')):<8}"
+        f" accuracy {result['accuracy']:4.0%}"
+        f" fast path {result['fast']:4.0%}"
+        + (f"  wrong: {', '.join(result['wrong'])}" if result.get("wrong") else "")
+    )
+    regressed = []
+    for metric in ("parse_ms", "extract_ms", "peak_kb"):
+        if baseline.get(metric) and result[metric] > baseline[metric] * (1 + tolerance):
+            regressed.append(metric)
+    return [f"{name}: {metric}" for metric in regressed]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the product page extractors")
+    parser.add_argument("--platform", choices=sorted(PAGES), help="Only run the pages of one platform")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per page, the fastest is reported")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or memory growth over the baseline")
+    parser.add_argument("--save", action="store_true", help="Save this run as this machine's baseline")
+    parser.add_argument("--compare", action="store_true", help="Fail on timing or memory regressions against the saved baseline")
+    parser.add_argument("--selectors", action="store_true", help="Show the hits of every selector after the run")
+    args = parser.parse_args()
+
+    pages = { fixture["page"]: bench_page(fixture, args.repeat) for fixture in load_fixtures(args.platform) }
+    platforms = summarize(pages)
+
+    baseline = { "pages": {}, "platforms": {} }
+    if (args.compare or args.save) and os.path.exists(BASELINE):
+        with open(BASELINE, encoding="utf-8") as f:
+            baseline = json.load(f)
+    elif args.compare:
+        print(f"No baseline at {BASELINE}, run with --save first\n")
+
+    wrong = [f"{name}: {', '.join(result['wrong'])}" for name, result in pages.items() if result["wrong"]]
+    regressions = []
+    for name, result in pages.items():
+        regressions += report(name, result, baseline["pages"].get(name, {}), args.tolerance)
+    print()
+    for platform, result in platforms.items():
+        regressions += report(platform, result, baseline["platforms"].get(platform, {}), args.tolerance)
+
+    if args.selectors:
+        for platform, chains in SELECTORS.items():
+            if args.platform and platform != args.platform:
+                continue
+            for field, chain in chains.items():
+                print(f"\n{platform}.{field}")
+                for pattern in chain.patterns:
+                    print(f"  {SELECTOR_HITS.get((platform, field, pattern), 0):6d}  {pattern}")
+
+    if args.save:
+        for result in pages.values():
+            result.pop("wrong")
+        with open(BASELINE, "w", encoding="utf-8") as f:
+            json.dump({ "pages": { **baseline["pages"], **pages }, "platforms": { **baseline["platforms"], **platforms } }, f, indent=4)
+            f.write("\n")
+        print(f"\nBaseline saved to {BASELINE}")
+    if wrong:
+        print("\nWrong fields:\n  " + "\n  ".join(wrong))
+    if args.compare and regressions:
+        print("\nRegressed against the baseline:\n  " + "\n  ".join(regressions))
+    sys.exit(1 if wrong or (args.compare and regressions) else 0)
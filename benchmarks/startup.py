@@ -0,0 +1,135 @@
+"""
+Cold start benchmark of the web app. Each run starts a fresh interpreter and
+reports how long `import main` takes, which heavy libraries it loaded, and the
+time from spawning the server until its first response, with the regular
+startup hook and with LAZY_STARTUP.
+
+    python -m benchmarks.startup                    # both modes, 5 runs each
+    python -m benchmarks.startup --mode lazy --repeat 10 --modules 15
+
+The eager mode connects the database in its startup hook, so it needs the same
+environment as the app; the first request is a GET of --path (/metrics by
+default), which touches neither the database nor Telegram.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Loaded by the scrapers and the database client, none of them is needed to answer /start
+HEAVY = ("bs4", "lxml", "soupsieve", "prisma", "deta", "bson", "pytz")
+
+IMPORT_PROBE = (
+    "import sys, time\n"
+    "started = time.perf_counter()\n"
+    "import main\n"
+    "elapsed = time.perf_counter() - started\n"
+    "print(elapsed, ','.join(name for name in {heavy!r} if name in sys.modules))\n"
+)
+
+
+def environment(lazy: bool) -> dict:
+    env = dict(os.environ, LAZY_STARTUP="1" if lazy else "0")
+    # aiogram validates the token format when the bot is built, no request is made with it
+    env.setdefault("BOT_TOKEN", "123456789:startup-benchmark")
+    return env
+
+
+def import_time(lazy: bool) -> tuple[float, list[str]]:
+    """Seconds to import main in a fresh interpreter, and the heavy libraries it pulled in."""
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE.format(heavy=HEAVY)],
+        cwd=ROOT, env=environment(lazy), capture_output=True, text=True, check=True,
+    ).stdout.split()
+    return float(out[0]), out[1].split(",") if len(out) > 1 else []
+
+
+def slowest_imports(lazy: bool, count: int) -> list[tuple[int, str]]:
+    """Top-level packages by the import time of all their modules in microseconds, from -X importtime."""
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=environment(lazy), capture_output=True, text=True, check=True,
+    ).stderr
+    packages: dict[str, int] = {}
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            package = name.strip().split(".")[0]
+            packages[package] = packages.get(package, 0) + int(own)
+    return sorted(((us, name) for name, us in packages.items()), reverse=True)[:count]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_response(lazy: bool, path: str, timeout: float) -> float:
+    """Seconds from spawning uvicorn until `path` answers with a 2xx status."""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=environment(lazy), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with {server.returncode}:\n{server.stderr.read()[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as res:
+                    if 200 <= res.status < 300:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError(f"No response from {path} within {timeout:.0f}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_mode(lazy: bool, repeat: int, path: str, timeout: float) -> dict:
+    imports, heavy = [], []
+    for _ in range(repeat):
+        seconds, heavy = import_time(lazy)
+        imports.append(seconds)
+    responses = [first_response(lazy, path, timeout) for _ in range(repeat)]
+    return { "import_ms": min(imports) * 1000, "first_response_ms": min(responses) * 1000, "heavy": heavy }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold start benchmark of the web app")
+    parser.add_argument("--mode", choices=("eager", "lazy", "both"), default="both", help="Startup mode to measure")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes per measurement, the fastest is reported")
+    parser.add_argument("--path", default="/metrics", help="Route requested as the first response")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for the server to answer")
+    parser.add_argument("--modules", type=int, default=0, help="Also list the packages slowest to import")
+    args = parser.parse_args()
+
+    modes = ("eager", "lazy") if args.mode == "both" else (args.mode,)
+    failed = False
+    for mode in modes:
+        lazy = mode == "lazy"
+        try:
+            result = bench_mode(lazy, args.repeat, args.path, args.timeout)
+        except (subprocess.CalledProcessError, RuntimeError, TimeoutError) as e:
+            print(f"{mode:<6} failed: {getattr(e, 'stderr', None) or e}")
+            failed = True
+            continue
+        print(
+            f"{mode:<6} import {result['import_ms']:8.1f} ms"
+            f"  first response {result['first_response_ms']:8.1f} ms"
+            f"  heavy modules: {', '.join(result['heavy']) or 'none'}"
+        )
+        if args.modules:
+            for us, name in slowest_imports(lazy, args.modules):
+                print(f"  {us / 1000:8.1f} ms  {name}")
+
+    sys.exit(1 if failed else 0)
@@ -1,10 +1,20 @@
+import asyncio
+import logging
+import re
+from typing import Optional
 from aiogram import Bot, types
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from md2tgmd import escape
 
 from bot.config import BOT_TOKEN
 from bot.handlers import dp
+from bot.jobs import jobs
 from bot.setup import set_default_commands, set_webhook
+from utils.platforms import url_pattern
+
+logger = logging.getLogger(__name__)
 
 
 bot = Bot(token=str(BOT_TOKEN), default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2))
@@ -14,5 +24,40 @@ async def init_bot(drop_pending_updates: bool = False):
     await set_webhook(bot, drop_pending_updates)
     await set_default_commands(bot)
 
-async def handle_webhook_update(update: types.Update):
-    return await dp.feed_webhook_update(bot, update)
\ No newline at end of file
+async def handle_webhook_update(update: types.Update, ack: Optional[asyncio.Task] = None):
+    # Handlers may take the acknowledgement as `status` and edit it
+    status = await ack if ack is not None else None
+    return await dp.feed_webhook_update(bot, update, status=status)
+
+async def __reply(message: types.Message, text: str) -> Optional[types.Message]:
+    try:
+        return await bot.send_message(message.chat.id, escape(text), reply_to_message_id=message.message_id)
+    except Exception as e:
+        logger.warning(f"Failed to reply to {message.chat.id}: {str(e)}")
+        return None
+
+def __reply_soon(message: types.Message, text: str) -> asyncio.Task:
+    # Sent in the background, the webhook answers Telegram without waiting for it
+    return asyncio.create_task(__reply(message, text))
+
+def queue_webhook_update(update: types.Update) -> bool:
+    """
+    Hands the update to the background job queue, keyed by the user it
+    comes from (or its chat), and returns False when that user already has
+    too many queued. Product links are acknowledged right away and a link
+    over the user's share is answered instead of dropped unseen.
+    """
+    context = UserContextMiddleware.resolve_event_context(update)
+    key = context.user.id if context.user else context.chat.id if context.chat else 0
+    message = update.message
+    is_link = bool(message and message.text and re.match(url_pattern, message.text))
+
+    ack = None
+    # The job reads `ack` when it runs, after it is set below
+    if not jobs.submit(key, lambda: handle_webhook_update(update, ack)):
+        if is_link:
+            __reply_soon(message, "You have too many links pending, please send this one again in a minute")
+        return False
+    if is_link:
+        ack = __reply_soon(message, "Got your link, adding it shortly... Please Wait!!")
+    return True
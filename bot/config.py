@@ -11,6 +11,45 @@ WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 WEBHOOK_PATH = "/tg_bot"
 
+# Cold start mode for serverless hosts: the database connects on its first
+# query and the parser pool starts on the first page, not in the startup hook
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "0") != "0"
+
+# Webhook updates are handled by background workers; the queue size bounds
+# pending updates overall and per user before Telegram is asked to retry
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "1000"))
+JOB_PER_USER = int(os.getenv("JOB_PER_USER", "5"))
+
+# Concurrency is bounded per host and across hosts by utils.throttle
+# Upper bound on due products picked up by one scheduled run
+SWEEP_LIMIT = int(os.getenv("SWEEP_LIMIT", "2000"))
+# Products leased per claim, and how long a lease lasts before others may take it over
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "100"))
+SWEEP_LEASE_SECONDS = float(os.getenv("SWEEP_LEASE_SECONDS", "300"))
+# Extractor retries one sweep may spend across all products, see utils.resilience
+SWEEP_RETRY_BUDGET = int(os.getenv("SWEEP_RETRY_BUDGET", "50"))
+# Seconds the scheduled action may run (keep it under the host's request time
+# limit, 0 for none), and how much of that is kept for the final writes; time
+# to send the run's notifications is kept on top, estimated from NOTIFY_RATE.
+# Products not reached stay due and head the next run's queue.
+SWEEP_TIME_BUDGET = float(os.getenv("SWEEP_TIME_BUDGET", "50"))
+SWEEP_DEADLINE_RESERVE = float(os.getenv("SWEEP_DEADLINE_RESERVE", "5"))
+# Outbox entries from earlier runs picked up by each run: cut off ones, and
+# ones held back for quiet hours or digest windows once those have passed
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+
+# One message per user and sweep holding all their price changes (split at
+# Telegram's length limit), instead of one per change. Users can also hold
+# them back with /digest and /quiet, see bot/digest.py
+NOTIFY_DIGEST = os.getenv("NOTIFY_DIGEST", "1") != "0"
+
+# Telegram allows ~30 messages/s overall and ~1 message/s into the same chat
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", "25"))
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", "1"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+
 # If the app is running in deta space
 if os.getenv("DETA_SPACE_APP"):
     WEBHOOK_URL = f"https://{os.getenv('DETA_SPACE_APP_HOSTNAME')}"
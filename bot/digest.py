@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+from md2tgmd import escape
+from prisma.models import UserSettings
+
+from bot.config import NOTIFY_DIGEST
+
+# Telegram rejects longer messages; counted on the escaped text, which is
+# never shorter than what Telegram counts after parsing the markdown
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n"
+# Longest digest window a user can pick, a week
+DIGEST_MAX_MINUTES = 7 * 24 * 60
+
+
+class Delivery(NamedTuple):
+    chat_id: int
+    text: str
+    # Outbox entries the message carries, removed once it is sent
+    ids: list[str]
+
+
+def parse_quiet_hours(arg: str) -> Optional[tuple[Optional[int], Optional[int]]]:
+    """Reads "22-7" as quiet from 22:00 to 07:00 and "off" as no quiet hours, None when invalid."""
+    if arg.lower() == "off":
+        return None, None
+    start, sep, end = arg.partition("-")
+    if not sep or not start.isdigit() or not end.isdigit():
+        return None
+    start, end = int(start), int(end)
+    if start > 23 or end > 23 or start == end:
+        return None
+    return start, end
+
+
+def in_quiet_hours(settings: UserSettings, now: datetime) -> bool:
+    start, end = settings.quiet_start, settings.quiet_end
+    if start is None or end is None:
+        return False
+    # Windows may wrap past midnight
+    return start <= now.hour < end if start < end else now.hour >= start or now.hour < end
+
+
+def is_due(settings: Optional[UserSettings], now: datetime) -> bool:
+    """Whether a user's held changes may be sent at `now`, in local time."""
+    if settings is None:
+        return True
+    if in_quiet_hours(settings, now):
+        return False
+    last = settings.last_digest_at
+    return not settings.digest_minutes or last is None or now - last >= timedelta(minutes=settings.digest_minutes)
+
+
+def next_delivery(settings: UserSettings, now: datetime) -> datetime:
+    """When changes held for a user at `now` may go out: after their digest window, outside quiet hours."""
+    at = now
+    if settings.digest_minutes and settings.last_digest_at:
+        at = max(at, settings.last_digest_at + timedelta(minutes=settings.digest_minutes))
+    at = at.astimezone(now.tzinfo)
+    if in_quiet_hours(settings, at):
+        end = at.replace(hour=settings.quiet_end, minute=0, second=0, microsecond=0)
+        at = end if end > at else end + timedelta(days=1)
+    return at
+
+
+def compose(entries: list[tuple[int, str, str]], digest: bool = NOTIFY_DIGEST) -> list[Delivery]:
+    """
+    Turns outbox entries (user id, text, outbox id) into messages. In digest
+    mode every user gets one message holding all their changes, split into
+    more only where it would pass Telegram's length limit.
+    """
+    if not digest:
+        return [Delivery(chat_id, text, [id]) for chat_id, text, id in entries]
+
+    by_user: dict[int, list[tuple[str, str]]] = {}
+    for chat_id, text, id in entries:
+        by_user.setdefault(chat_id, []).append((text, id))
+
+    deliveries: list[Delivery] = []
+    for chat_id, items in by_user.items():
+        if len(items) == 1:
+            text, id = items[0]
+            deliveries.append(Delivery(chat_id, text, [id]))
+            continue
+
+        parts: list[str] = [escape(f"📬 {len(items)} price changes since your last update")]
+        ids: list[str] = []
+        length = len(parts[0])
+        for text, id in items:
+            if ids and length + len(DIGEST_SEPARATOR) + len(text) > MESSAGE_LIMIT:
+                deliveries.append(Delivery(chat_id, DIGEST_SEPARATOR.join(parts), ids))
+                parts, ids, length = [], [], -len(DIGEST_SEPARATOR)
+            parts.append(text)
+            ids.append(id)
+            length += len(DIGEST_SEPARATOR) + len(text)
+        deliveries.append(Delivery(chat_id, DIGEST_SEPARATOR.join(parts), ids))
+    return deliveries
@@ -3,11 +3,14 @@ from aiogram import Dispatcher, F
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
 from md2tgmd import escape
-import re
+from datetime import datetime, timedelta
+from typing import Optional
 
-from utils.scraper import scrape
-from utils.db import get_tracker, track_by_user, add_tracker, delete_tracker
-from utils.regex_patterns import amazon_url_patterns, flipkart_url_patterns, all_url_patterns
+from utils.platforms import resolve, url_pattern
+
+# The scrapers (bs4, lxml) and the database client (prisma or deta) are
+# imported by the handlers that use them, so /start and /help answer on a
+# cold start without loading either
 
 logger = logging.getLogger(__name__)
 dp = Dispatcher()
@@ -35,6 +38,8 @@ async def help(message: Message):
         "1. `/my_trackings`: View all the products you are currently tracking.\n"
         "2. `/stop < product_id >`: Stop tracking a specific product. Replace `<product_id>` with the product ID you want to stop tracking.\n"
         "3. `/product < product_id >`: Get detailed information about a specific product. Replace `<product_id>` with the product ID you want information about.\n"
+        "4. `/digest < minutes >`: Get your price changes together at most once every `<minutes>`, `0` to get them after every check.\n"
+        "5. `/quiet < start-end >`: Hold price changes back between these hours, for example `/quiet 22-7`, or `/quiet off`.\n"
         "\n\n**How It Works:**\n\n"
         "1. Send the product link from Flipkart.\n"
         "2. The bot will automatically scrape and track the product.\n"
@@ -47,6 +52,8 @@ async def help(message: Message):
 @dp.message(Command("my_trackings"))
 async def track(message: Message):
     try:
+        from utils.db import track_by_user
+
         chat_id = message.chat.id
         text = await message.reply(escape("Fetching Your Products..."))
         trackers = await track_by_user(chat_id)
@@ -71,21 +78,24 @@ async def track(message: Message):
         logger.error(e, exc_info=True)
 
 
-@dp.message(F.text.regexp("|".join(all_url_patterns)))
-async def track_flipkart_url(message: Message):
+@dp.message(F.text.regexp(url_pattern))
+async def track_flipkart_url(message: Message, status: Optional[Message] = None):
     try:
-        url = message.text or ""
-        if any(re.match(pattern, url) for pattern in amazon_url_patterns):
-            platform = "amazon"
-        elif any(re.match(pattern, url) for pattern in flipkart_url_patterns):
-            platform = "flipkart"
+        from utils.scraper import scrape
+        from utils.db import add_tracker
+
+        product = await resolve(message.text or "")
+        platform = product.platform
+        text = escape(f"Adding Your Product from {platform.capitalize()}... Please Wait!!")
+        # `status` is the acknowledgement sent when the link was queued
+        if status:
+            await status.edit_text(text)
         else:
-            platform = "generic"
-        product_name, price = await scrape(url, platform)
-        status = await message.reply(escape(f"Adding Your Product from {platform.capitalize()}... Please Wait!!"))
+            status = await message.reply(text)
+        product_name, price = await scrape(product.url, platform)
         if product_name and price and message.text:
             tracker = await add_tracker(
-                message.chat.id, product_name, message.text, float(price)
+                message.chat.id, product_name, product.url, float(price), product.key
             )
             if tracker:
                 await status.edit_text(escape(
@@ -101,6 +111,8 @@ async def track_flipkart_url(message: Message):
 @dp.message(Command("product"))
 async def track_product(message: Message):
     try:
+        from utils.db import get_tracker, get_price_history, timezone
+
         if message.text:
             __, id = message.text.split()
             status = await message.reply(escape("Getting Product Info...."))
@@ -112,14 +124,19 @@ async def track_product(message: Message):
                     product_price = product.price
                     maximum_price = product.upper
                     minimum_price = product.lower
+                    history = await get_price_history(product.id, datetime.now(timezone) - timedelta(days=30))
 
                     products_message = (
                         f"🛍 **Product:** [{product_name}]({product_url})\n\n"
                         f"💲 **Current Price:** {product_price}\n"
                         f"📉 **Lowest Price:** {minimum_price}\n"
                         f"📈 **Highest Price:** {maximum_price}\n"
-                        f"\n\n\nTo Stop Tracking, use `/stop {id}`"
                     )
+                    if history:
+                        low = min(product_price, *(point.min for point in history))
+                        high = max(product_price, *(point.max for point in history))
+                        products_message += f"📊 **Last 30 Days:** {low} - {high} ({len(history)} price points)\n"
+                    products_message += f"\n\n\nTo Stop Tracking, use `/stop {id}`"
 
                     await status.edit_text(escape(products_message), disable_web_page_preview=True)
                 else:
@@ -133,6 +150,8 @@ async def track_product(message: Message):
 @dp.message(Command("stop"))
 async def delete_product(message: Message):
     try:
+        from utils.db import delete_tracker
+
         if message.text:
             __, id = message.text.split()
             status = await message.reply(escape("Deleting Product...."))
@@ -148,3 +167,48 @@ async def delete_product(message: Message):
     except Exception as e:
         logger.error(e, exc_info=True)
 
+
+
+@dp.message(Command("digest"))
+async def set_digest(message: Message):
+    try:
+        from bot.digest import DIGEST_MAX_MINUTES
+        from utils.db import save_user_settings
+
+        args = (message.text or "").split()
+        if len(args) != 2 or not args[1].isdigit():
+            await message.reply(escape("Usage: `/digest < minutes >`, for example `/digest 60`, or `/digest 0` to turn it off"))
+            return
+        minutes = min(int(args[1]), DIGEST_MAX_MINUTES)
+        if await save_user_settings(message.chat.id, digest_minutes=minutes):
+            await message.reply(escape(
+                f"You will get your price changes together at most once every {minutes} minutes"
+                if minutes else "You will get your price changes after every check"
+            ))
+        else:
+            await message.reply("Failed to save your settings")
+    except Exception as e:
+        logger.error(e, exc_info=True)
+
+
+@dp.message(Command("quiet"))
+async def set_quiet_hours(message: Message):
+    try:
+        from bot.digest import parse_quiet_hours
+        from utils.db import save_user_settings
+
+        args = (message.text or "").split()
+        hours = parse_quiet_hours(args[1]) if len(args) == 2 else None
+        if hours is None:
+            await message.reply(escape("Usage: `/quiet < start-end >` with hours from 0 to 23, for example `/quiet 22-7`, or `/quiet off`"))
+            return
+        start, end = hours
+        if await save_user_settings(message.chat.id, quiet_start=start, quiet_end=end):
+            await message.reply(escape(
+                f"Price changes will wait between {start:02d}:00 and {end:02d}:00"
+                if start is not None else "Quiet hours turned off"
+            ))
+        else:
+            await message.reply("Failed to save your settings")
+    except Exception as e:
+        logger.error(e, exc_info=True)
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from bot.config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_PER_USER
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable]
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    In-process background jobs run by a fixed pool of workers. Jobs are kept
+    per user and users are served round-robin, one job at a time each, so a
+    user pasting many links cannot hold up everyone else. `submit` raises
+    QueueFull when the whole queue is full and returns False when only the
+    user's share of it is.
+    """
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_QUEUE_SIZE, per_user: int = JOB_PER_USER):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self.pending = 0
+        self._jobs: dict[int, deque[Job]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info(f"Job queue started with {self.workers} workers.")
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._stopping = False
+        self._tasks = []
+        self._jobs.clear()
+        self.pending = 0
+
+    def submit(self, user_id: int, job: Job) -> bool:
+        if self._ready is None:
+            self.start()
+        if self.pending >= self.max_pending:
+            raise QueueFull()
+
+        jobs = self._jobs.get(user_id)
+        if jobs is None:
+            jobs = self._jobs[user_id] = deque()
+            # The user has nothing queued or running, give them a turn
+            self._ready.put_nowait(user_id)
+        elif len(jobs) >= self.per_user:
+            return False
+
+        jobs.append(job)
+        self.pending += 1
+        return True
+
+    async def _work(self):
+        while True:
+            user_id = await self._ready.get()
+            jobs = self._jobs[user_id]
+            job = jobs.popleft()
+            try:
+                await job()
+            except asyncio.CancelledError:
+                if self._stopping:
+                    raise
+                # Raised by something the job awaited, not aimed at this worker
+                logger.warning(f"Job for {user_id} was cancelled")
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            finally:
+                self.pending -= 1
+                if jobs:
+                    self._ready.put_nowait(user_id)
+                else:
+                    del self._jobs[user_id]
+
+
+jobs = JobQueue()
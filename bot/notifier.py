@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from typing import NamedTuple, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+
+from bot.config import NOTIFY_CONCURRENCY, NOTIFY_RATE, NOTIFY_CHAT_INTERVAL, NOTIFY_MAX_RETRIES
+from utils.metrics import NOTIFICATIONS, NOTIFY_SECONDS, timer
+
+logger = logging.getLogger(__name__)
+
+
+class NotifyStats(NamedTuple):
+    sent: int
+    failed: int
+    seconds: float
+    # Indexes of the messages left unsent because the deadline passed or
+    # Telegram stayed unreachable, worth another try later
+    unsent: tuple[int, ...] = ()
+
+    @property
+    def rate(self):
+        return self.sent / self.seconds if self.seconds else 0.0
+
+
+class Notifier:
+    """
+    Sends a batch of messages through a bounded pool of workers while staying
+    under Telegram's global and per-chat limits. A failed message is counted
+    and skipped, it never aborts the rest of the batch. With a deadline (in
+    event loop time) no message is sent, or waited for, past it.
+    """
+    def __init__(self, bot: Bot, concurrency: int = NOTIFY_CONCURRENCY, rate: float = NOTIFY_RATE, chat_interval: float = NOTIFY_CHAT_INTERVAL):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.interval = 1 / rate
+        self.chat_interval = chat_interval
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._chat_slots: dict[int, float] = {}
+
+    async def _wait_turn(self, chat_id: int, deadline: Optional[float] = None) -> bool:
+        """Waits for the chat's next turn, False without waiting when it would come after `deadline`."""
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._lock:
+                now = loop.time()
+                # After a pause _next_slot starts from its end, see _pause
+                slot = max(now, self._next_slot, self._chat_slots.get(chat_id, 0.0))
+                if deadline is not None and slot >= deadline:
+                    return False
+                self._next_slot = max(self._next_slot, now) + self.interval
+                self._chat_slots[chat_id] = slot + self.chat_interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # A retry_after pause that started while this turn was waiting voids
+            # it, the turn is taken again behind the pause to keep both limits
+            if self._paused_until <= loop.time():
+                return True
+
+    def _pause(self, seconds: float):
+        # Telegram's retry_after applies to the whole bot, hold every worker back
+        self._paused_until = max(self._paused_until, asyncio.get_running_loop().time() + seconds)
+        self._next_slot = max(self._next_slot, self._paused_until)
+
+    async def _send(self, chat_id: int, text: str, deadline: Optional[float] = None) -> Optional[bool]:
+        """True once sent, False when Telegram refused it for good, None when retries ran out or the deadline came first."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(NOTIFY_MAX_RETRIES + 1):
+            if not await self._wait_turn(chat_id, deadline):
+                break
+            try:
+                with timer(NOTIFY_SECONDS):
+                    await self.bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=True)
+                NOTIFICATIONS.labels(result="sent").inc()
+                return True
+            except TelegramRetryAfter as e:
+                logger.warning(f"Rate limited by Telegram, retrying after {e.retry_after}s")
+                NOTIFICATIONS.labels(result="retry_after").inc()
+                self._pause(e.retry_after)
+            except TelegramNetworkError as e:
+                # Transient, unlike the API's own errors
+                logger.warning(f"Network error notifying {chat_id}, retrying: {str(e)}")
+                NOTIFICATIONS.labels(result="retry_network").inc()
+                backoff = 0.5 * 2 ** attempt
+                if attempt < NOTIFY_MAX_RETRIES:
+                    if deadline is not None and loop.time() + backoff >= deadline:
+                        break
+                    await asyncio.sleep(backoff)
+            except TelegramAPIError as e:
+                logger.warning(f"Failed to notify {chat_id}: {str(e)}")
+                NOTIFICATIONS.labels(result="failed").inc()
+                return False
+            except Exception as e:
+                logger.error(f"Failed to notify {chat_id}: {str(e)}", exc_info=True)
+                NOTIFICATIONS.labels(result="failed").inc()
+                return False
+        NOTIFICATIONS.labels(result="deferred").inc()
+        return None
+
+    async def send_all(self, messages: list[tuple[int, str]], deadline: Optional[float] = None) -> NotifyStats:
+        queue: asyncio.Queue[tuple[int, int, str]] = asyncio.Queue()
+        for index, (chat_id, text) in enumerate(messages):
+            queue.put_nowait((index, chat_id, text))
+        sent = failed = 0
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        deferred: list[int] = []
+
+        async def worker():
+            nonlocal sent, failed
+            while not queue.empty():
+                if deadline is not None and loop.time() >= deadline:
+                    return
+                index, chat_id, text = queue.get_nowait()
+                result = await self._send(chat_id, text, deadline)
+                if result:
+                    sent += 1
+                elif result is None:
+                    deferred.append(index)
+                else:
+                    failed += 1
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(messages)))))
+
+        unsent = tuple(deferred) + tuple(queue.get_nowait()[0] for _ in range(queue.qsize()))
+        stats = NotifyStats(sent, failed, time.monotonic() - started, unsent)
+        logger.info(f"Notified {stats.sent} messages ({stats.failed} failed, {len(unsent)} left) in {stats.seconds:.1f}s, {stats.rate:.1f} msg/s")
+        return stats
@@ -1,60 +1,249 @@
 import asyncio
 import logging
-import re
+import os
+import secrets
+import socket
 import time
-from utils.scraper import scrape
+from datetime import datetime
+from typing import Optional
+from utils.scraper import scrape_product, scrape_cache
 from fastapi import Request, Response
+from md2tgmd import escape
 
 from bot import bot
-from utils.regex_patterns import amazon_url_patterns, flipkart_url_patterns
-from utils.db import all_products, update_product_price, track_by_product, Product
+from bot.config import SWEEP_LIMIT, SWEEP_BATCH_SIZE, SWEEP_LEASE_SECONDS, SWEEP_RETRY_BUDGET, SWEEP_TIME_BUDGET, SWEEP_DEADLINE_RESERVE, OUTBOX_BATCH_SIZE, NOTIFY_DIGEST, NOTIFY_RATE
+from bot.digest import compose, is_due, next_delivery
+from bot.notifier import Notifier
+from utils.platforms import canonicalize, resolve
+from utils.resilience import RetryBudget
+from utils.schedule import reschedule, reschedule_failed
+from utils.throttle import TOTAL_CONCURRENCY
+from utils.metrics import DIGEST_ENTRIES, SWEEP_PRODUCTS, SWEEP_SECONDS
+from utils.db import claim_due_products, renew_product_leases, update_products, price_update, track_by_products, append_price_history, compact_price_history, queue_notifications, claim_notifications, release_notifications, delete_notifications, get_user_settings, mark_digests_sent, timezone, Product
 
 logger = logging.getLogger(__name__)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
 
 
-async def check_prices(_: Request):
-    updated_products: list[Product] = []
-
-    logger.info("Checking Price for Products...")
-    for product in await all_products():
-        if any(re.match(pattern, product.url) for pattern in amazon_url_patterns):
-            platform = "amazon"
-        elif any(re.match(pattern, product.url) for pattern in flipkart_url_patterns):
-            platform = "flipkart"
-        else:
-            platform = "generic"
-        __, current_price = await scrape(product.url, platform)
-        await asyncio.sleep(1)
-        if current_price is not None:
-            if current_price != product.price and (updated_product := await update_product_price(product.id, float(current_price))):
-                updated_products.append(updated_product)
-    logger.info("Completed")
-    
-    changed_products = await compare_prices(updated_products)
-    for changed_product in changed_products:
-        trackers = await track_by_product(changed_product.id)
-        for tracker in trackers:
-            if product:= tracker.product:
-                percentage_change = (
-                    (product.price - product.previous_price)
-                    / product.previous_price
-                ) * 100
-                text = (
-                    f"🎉 Good news! The price of {product.product_name} has changed.\n"
-                    f"   - Previous Price: ₹{product.previous_price:.2f}\n"
-                    f"   - Current Price: ₹{product.price:.2f}\n"
-                    f"   - Percentage Change: {percentage_change:.2f}%\n"
-                    f"   - [Check it out here]({product.url})"
-                )
-                await bot.send_message(
-                    chat_id=tracker.user_id,
-                    text=text,
-                    disable_web_page_preview=True
-                )
+async def check_product(products: list[Product], budget: RetryBudget) -> list[tuple[Product, dict]]:
+    """
+    Scrapes one physical product once and returns the fields to write for
+    every stored row pointing at it: new price and fetch validators when the
+    page changed, the extractor that worked, and always the next time it is due.
+    A scrape that read nothing only moves the next check, retried soon.
+    """
+    head = products[0]
+    # Requests wait for their host's pace and slots in utils.throttle
+    target = await resolve(head.url)
+    page = await scrape_product(target.url, target.platform, head.etag, head.last_modified, head.content_hash, head.history_code, head.extractor, budget)
+
+    try:
+        current_price = float(page.price) if page.price else None
+    except ValueError:
+        logger.warning(f"Unparsable price {page.price!r} for {target.url}")
+        current_price = None
+
+    now = datetime.now(timezone)
+    seen = page.not_modified or bool(page.title and page.price)
+    # Validators are only replaced by a fetch that read the page, a failed or skipped one has none
+    fetch_state = page.fetch_state() if seen and not page.not_modified else {}
+    # Remembered so the next sweep skips failing extractors and the pricehistory search
+    if page.extractor:
+        fetch_state["extractor"] = page.extractor
+    if page.history_code:
+        fetch_state["history_code"] = page.history_code
+    updates: list[tuple[Product, dict]] = []
+    for product in products:
+        fields = { key: value for key, value in fetch_state.items() if getattr(product, key) != value }
+        changed = current_price is not None and current_price != product.price
+        if changed:
+            fields.update(price_update(product, current_price))
+        fields.update(reschedule(product, changed, now) if seen else reschedule_failed(product, now))
+        updates.append((product, fields))
+    return updates
+
+
+def send_seconds(entries: list[tuple[int, str, str]]) -> float:
+    """Rough time needed to send the entries, kept free at the end of a time-budgeted run."""
+    messages = len({ user_id for user_id, _, _ in entries }) if NOTIFY_DIGEST else len(entries)
+    return messages / NOTIFY_RATE
+
+
+async def notify(entries: list[tuple[int, str, str]], owner: str, deadline: Optional[float]):
+    """
+    Sends outbox entries (user id, text, outbox id) to the users whose
+    delivery window is open, as digests, and removes the entries that were
+    sent or failed for good. Only entries `owner` still holds a lease on are
+    sent, another run may have taken over some once the lease ran out. Held
+    entries are released until their user's window opens, so claims skip
+    them meanwhile, and unsent ones for the next sweep.
+    """
+    ids = [id for _, _, id in entries if id]
+    owned = { message.id for message in await claim_notifications(owner, SWEEP_LEASE_SECONDS, len(ids), ids) } if ids else set()
+    # Entries that could not be written to the outbox have no id, only this run knows them
+    entries = [entry for entry in entries if not entry[2] or entry[2] in owned]
+    if lost := len(ids) - len(owned):
+        logger.info(f"Skipping {lost} notifications another run has taken over")
+
+    now = datetime.now(timezone)
+    settings = await get_user_settings(list({ user_id for user_id, _, _ in entries }))
+    due: list[tuple[int, str, str]] = []
+    held: dict[int, list[str]] = {}
+    for entry in entries:
+        if is_due(settings.get(entry[0]), now):
+            due.append(entry)
+        elif entry[2]:
+            held.setdefault(entry[0], []).append(entry[2])
+    if held:
+        count = sum(len(ids) for ids in held.values())
+        DIGEST_ENTRIES.labels(result="held").inc(count)
+        logger.info(f"Holding {count} notifications for quiet hours or digest windows")
+        await asyncio.gather(*(
+            release_notifications(ids, next_delivery(settings[user_id], now)) for user_id, ids in held.items()
+        ))
+    if not due:
+        return
+
+    deliveries = compose(due)
+    # Stops early enough to record what was sent before the deadline
+    send_deadline = deadline - SWEEP_DEADLINE_RESERVE if deadline is not None else None
+    stats = await Notifier(bot).send_all([(delivery.chat_id, delivery.text) for delivery in deliveries], send_deadline)
+    unsent = set(stats.unsent)
+    done = [delivery for index, delivery in enumerate(deliveries) if index not in unsent]
+    DIGEST_ENTRIES.labels(result="sent").inc(sum(len(delivery.ids) for delivery in done))
+    await delete_notifications([id for delivery in done for id in delivery.ids if id])
+    await release_notifications([id for index in unsent for id in deliveries[index].ids if id])
+    await mark_digests_sent([
+        chat_id for chat_id in { delivery.chat_id for delivery in done }
+        if chat_id in settings and settings[chat_id].digest_minutes
+    ], now)
+
+
+async def flush_outbox(owner: str) -> list[tuple[int, str, str]]:
+    """Leases the outbox entries left by earlier sweeps, interrupted or held back for their users."""
+    pending = await claim_notifications(owner, SWEEP_LEASE_SECONDS, OUTBOX_BATCH_SIZE)
+    if pending:
+        logger.info(f"Found {len(pending)} notifications left by earlier sweeps")
+    return [(message.user_id, message.text, message.id) for message in pending]
+
+
+async def keep_leases(products: list[Product]):
+    """Renews the leases on claimed products until cancelled, a batch against slow hosts can outlive one."""
+    while True:
+        await asyncio.sleep(SWEEP_LEASE_SECONDS / 3)
+        await renew_product_leases(products, SWEEP_LEASE_SECONDS)
+
 
+async def check_batch(products: list[Product], budget: RetryBudget, owner: str) -> list[tuple[int, str, str]]:
+    """
+    Checks a batch of claimed products and returns the outbox entries of their
+    price changes, leased to `owner`. Products whose lease was lost anyway
+    are not written, the worker that took them over has newer results.
+    """
+    groups: dict[str, list[Product]] = {}
+    for product in products:
+        groups.setdefault(product.product_key or canonicalize(product.url).key, []).append(product)
+
+    renewal = asyncio.create_task(keep_leases(products))
+    try:
+        results = await asyncio.gather(*(check_product(group, budget) for group in groups.values()))
+    finally:
+        renewal.cancel()
+    # Writing the results also hands the leases back
+    updates = [(product, { **fields, "lease_owner": None, "lease_until": None }) for group in results for product, fields in group]
+    price_changed = { product.id for product, fields in updates if "price" in fields }
+    updated_products = await update_products(updates, leased=True)
+    if lost := len(updates) - len(updated_products):
+        logger.warning(f"Left out {lost} products, their lease ran out or the write failed")
+
+    changed_products = await compare_prices([product for product in updated_products if product.id in price_changed])
+    if changed_products:
+        await append_price_history([(product.id, product.price) for product in changed_products])
+        await compact_price_history([product.id for product in changed_products])
+        products_by_id = { product.id: product for product in changed_products }
+        trackers = await track_by_products(list(products_by_id))
+        messages = [(tracker.user_id, format_price_change(products_by_id[tracker.product_id])) for tracker in trackers]
+        # Written before sending, so a run cut off before the end still delivers them next time
+        ids = await queue_notifications(messages, owner, SWEEP_LEASE_SECONDS) or [""] * len(messages)
+        return [(user_id, text, id) for (user_id, text), id in zip(messages, ids)]
+    return []
+
+
+async def run_sweep(worker_id: str = WORKER_ID, limit: int = SWEEP_LIMIT, time_budget: float = 0) -> int:
+    """
+    Claims batches of due products under a lease and checks them until none
+    are due or `limit` is reached. Any number of workers can run this at once.
+
+    With a `time_budget` the run sizes its batches from the time products
+    have taken so far and stops claiming before the budget runs out. The due
+    queue is the checkpoint: checked products move back in it, the rest stay
+    at its head for the next run.
+
+    Price changes are written to the outbox as they are found and delivered
+    at the end, one digest per user together with entries earlier runs left
+    or held back, so outbound messages grow with users rather than trackers.
+    """
+    budget = RetryBudget(SWEEP_RETRY_BUDGET)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + time_budget if time_budget else None
+    started = time.monotonic()
+    checked = 0
+    # Seconds per product of the batches so far, to size the next one
+    per_product: Optional[float] = None
+    # Holds this run's outbox leases
+    owner = f"{worker_id}:{secrets.token_hex(8)}"
+
+    logger.info(f"Checking Price for Products on {worker_id}...")
+    entries = await flush_outbox(owner)
+    while checked < limit:
+        size = min(SWEEP_BATCH_SIZE, limit - checked)
+        if deadline is not None:
+            remaining = deadline - loop.time() - SWEEP_DEADLINE_RESERVE - send_seconds(entries)
+            # The first batch only calibrates
+            size = min(size, int(remaining / per_product) if per_product else TOTAL_CONCURRENCY)
+            if remaining <= 0 or size < 1:
+                logger.info(f"Stopping before the time budget runs out, {checked} products checked")
+                break
+
+        products, candidates = await claim_due_products(worker_id, size, SWEEP_LEASE_SECONDS)
+        if not products:
+            if candidates:
+                # Other workers leased every candidate first, more may be due behind them
+                continue
+            break
+        batch_started = loop.time()
+        entries += await check_batch(products, budget, owner)
+        took = (loop.time() - batch_started) / len(products)
+        per_product = took if per_product is None else (per_product + took) / 2
+        checked += len(products)
+        SWEEP_PRODUCTS.inc(len(products))
+
+    if entries:
+        await notify(entries, owner, deadline)
+    SWEEP_SECONDS.observe(time.monotonic() - started)
+    logger.info(f"Completed {checked} due products in {time.monotonic() - started:.1f}s, scrape cache: {scrape_cache.stats()}")
+    return checked
+
+
+async def check_prices(_: Request):
+    await run_sweep(time_budget=SWEEP_TIME_BUDGET)
     return Response(status_code=200)
 
 
+def format_price_change(product: Product) -> str:
+    percentage_change = (
+        (product.price - product.previous_price)
+        / product.previous_price
+    ) * 100
+    return escape(
+        f"🎉 Good news! The price of {product.product_name} has changed.\n"
+        f"   - Previous Price: ₹{product.previous_price:.2f}\n"
+        f"   - Current Price: ₹{product.price:.2f}\n"
+        f"   - Percentage Change: {percentage_change:.2f}%\n"
+        f"   - [Check it out here]({product.url})"
+    )
+
+
 async def compare_prices(products: list[Product] = []):
     logger.info("Comparing Prices...")
     product_with_changes: list[Product] = []
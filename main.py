@@ -3,13 +3,16 @@ from aiogram import types
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request, Response
 import os
+import sys
 import uvicorn
 
-from bot import handle_webhook_update, init_bot
-from bot.scheduler import check_prices
-from bot.config import WEBHOOK_SECRET, WEBHOOK_PATH
+from bot import queue_webhook_update, init_bot
+from bot.jobs import jobs, QueueFull
+from bot.config import LAZY_STARTUP, WEBHOOK_SECRET, WEBHOOK_PATH
 from models import ActionBody
-from utils.db import connect, disconnect
+from utils.http import start_http, close_http
+from utils.metrics import WEBHOOK_SECONDS, WEBHOOK_UPDATES, render, timer
+from utils.parser_pool import start_parser_pool, close_parser_pool
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -27,20 +30,37 @@ async def setup(drop_pending: bool = False):
     logger.info("Bot has been initialized...")
     return Response(status_code=200, content="Bot has been initialized...")
 
+@app.get('/metrics')
+async def metrics():
+    content, content_type = render()
+    return Response(content=content, media_type=content_type)
+
 @app.post(WEBHOOK_PATH)
 async def handle_webhook(request: Request):
     secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
 
     if secret == WEBHOOK_SECRET:
-        try:
-            update = types.Update(**await request.json())
-            await handle_webhook_update(update)
-            return Response()
-        
-        except Exception as e:
-            logger.error(e, exc_info=True)
-            raise HTTPException(status_code=500, detail="Internal server error: " + str(e))
+        with timer(WEBHOOK_SECONDS):
+            try:
+                update = types.Update(**await request.json())
+                if queue_webhook_update(update):
+                    WEBHOOK_UPDATES.labels(result="queued").inc()
+                else:
+                    WEBHOOK_UPDATES.labels(result="dropped").inc()
+                    logger.warning(f"Dropped update {update.update_id}, its user has too many updates queued")
+                return Response()
+
+            except QueueFull:
+                WEBHOOK_UPDATES.labels(result="busy").inc()
+                # Telegram redelivers the update later
+                raise HTTPException(status_code=503, detail="Busy, retry later")
+
+            except Exception as e:
+                WEBHOOK_UPDATES.labels(result="error").inc()
+                logger.error(e, exc_info=True)
+                raise HTTPException(status_code=500, detail="Internal server error: " + str(e))
     else:
+        WEBHOOK_UPDATES.labels(result="forbidden").inc()
         raise HTTPException(status_code=403, detail="Forbidden: Wrong secret token")
 
     
@@ -49,15 +69,28 @@ async def handle_actions(action: ActionBody, request: Request):
     event = action.event
 
     if (event.id == "scheduled_price_check"):
+        # Loads the scrapers and the database client on the first sweep
+        from bot.scheduler import check_prices
         return await check_prices(request)
 
     raise HTTPException(status_code=404, detail="Action not found")
 
 async def on_startup():
-    await connect()
+    if not LAZY_STARTUP:
+        from utils.db import connect
+        await connect()
+        start_parser_pool()
+    await start_http()
+    jobs.start()
 
 async def on_shutdown():
-    await disconnect()
+    await jobs.stop()
+    await close_http()
+    close_parser_pool()
+    # Only disconnects a database that some request has loaded
+    if "utils.db" in sys.modules:
+        from utils.db import disconnect
+        await disconnect()
 
 app.add_event_handler("startup", on_startup)
 app.add_event_handler("shutdown", on_shutdown)
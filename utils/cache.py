@@ -0,0 +1,109 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class _LoadCancelled(Exception):
+    """The caller running a coalesced load was cancelled, its waiters retry the load."""
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire `ttl` seconds after being
+    stored. `get_or_load` coalesces concurrent misses for the same key into a
+    single call of the loader; when the caller running it is cancelled, one
+    of the waiters takes the load over. `on_evict` is called with the key and
+    value of every entry that leaves the cache, expired, evicted or popped.
+    """
+    def __init__(self, maxsize: int, ttl: float, on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            self.pop(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self.pop(next(iter(self._data)))
+
+    def replace(self, key: Hashable, value) -> bool:
+        """Swaps a live entry's value but keeps its expiry, False when there is none."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return False
+        self._data[key] = (entry[0], value)
+        return True
+
+    def pop(self, key: Hashable):
+        entry = self._data.pop(key, None)
+        if entry is not None and self.on_evict is not None:
+            self.on_evict(key, entry[1])
+
+    def clear(self):
+        for key in list(self._data):
+            self.pop(key)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable], cacheable: Optional[Callable[[Any], bool]] = None):
+        sentinel = object()
+        while True:
+            if (value := self.get(key, sentinel)) is not sentinel:
+                self.hits += 1
+                return value
+            if (future := self._inflight.get(key)) is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except _LoadCancelled:
+                # Only the loading caller was cancelled, the first waiter back here loads instead
+                continue
+
+        self.misses += 1
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await loader()
+            if cacheable is None or cacheable(value):
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.set_exception(_LoadCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here so waiter-less failures are not reported as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
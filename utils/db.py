@@ -1,43 +1,113 @@
+import asyncio
+import functools
+import heapq
 import json
 import logging
 import os
+from typing import AsyncIterator, Optional
 from prisma.client import Prisma
-from prisma.models import Product, PriceTracker
+from prisma.models import Product, PriceTracker, PriceHistory, Notification, UserSettings
 from prisma.types import ProductCreateInput
 from bson.objectid import ObjectId
 from deta import Deta
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 
+from utils.cache import TTLCache
+from utils.metrics import DB_SECONDS, timed
+
 DETA_APP = True if os.getenv("DETA_SPACE_APP", False) else False
 logger = logging.getLogger(__name__)
 timezone = pytz.timezone("Asia/Kolkata")
+# Writes per batch_() transaction; Deta's put_many is capped at 25 items
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "25" if DETA_APP else "500"))
+# Concurrent Deta Base requests when joining products into trackers
+DETA_FETCH_CONCURRENCY = int(os.getenv("DETA_FETCH_CONCURRENCY", "8"))
+# Read-through cache for the bot commands' tracker lookups
+TRACKER_CACHE_SIZE = int(os.getenv("TRACKER_CACHE_SIZE", "2048"))
+TRACKER_CACHE_TTL = float(os.getenv("TRACKER_CACHE_TTL", "300"))
+# Price history keeps every change for HISTORY_RAW_DAYS, then one
+# min/max/last bucket per day until HISTORY_RETENTION_DAYS
+HISTORY_RAW_DAYS = int(os.getenv("HISTORY_RAW_DAYS", "30"))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "730"))
+
 
 if DETA_APP:
     deta_db = Deta()
     price_trackers_base = deta_db.AsyncBase("price_trackers")
     products_base = deta_db.AsyncBase("products")
+    price_history_base = deta_db.AsyncBase("price_history")
+    notifications_base = deta_db.AsyncBase("notifications")
+    user_settings_base = deta_db.AsyncBase("user_settings")
 else:
     prisma_db = Prisma()
     price_trackers = prisma_db.pricetracker
     products = prisma_db.product
+    price_history = prisma_db.pricehistory
+    notifications = prisma_db.notification
+    user_settings = prisma_db.usersettings
+
+
+__connect_lock: Optional[asyncio.Lock] = None
 
 
 async def connect():
-    if not DETA_APP:
-        await prisma_db.connect()
+    """Opens the connection once; every query calls it, so the startup hook may skip it."""
+    global __connect_lock
+    if DETA_APP or prisma_db.is_connected():
+        return
+    if __connect_lock is None:
+        __connect_lock = asyncio.Lock()
+    async with __connect_lock:
+        if not prisma_db.is_connected():
+            await prisma_db.connect()
+            logger.info("Database connected.")
 
 async def disconnect():
-    if not DETA_APP:
+    if not DETA_APP and prisma_db.is_connected():
         await prisma_db.disconnect()
 
+def __chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+async def __base_iter_pages(base, query=None, limit: int = 1000) -> AsyncIterator[list[dict]]:
+    res = await base.fetch(query, limit=limit)
+    yield res.items
+    while res.last:
+        res = await base.fetch(query, limit=limit, last=res.last)
+        yield res.items
+
+async def __base_fetch_all(base, query=None) -> list[dict]:
+    items: list[dict] = []
+    async for page in __base_iter_pages(base, query):
+        items.extend(page)
+    return items
+
+async def __base_get_items(base, keys) -> dict[str, dict]:
+    semaphore = asyncio.Semaphore(DETA_FETCH_CONCURRENCY)
+
+    async def get(key: str):
+        async with semaphore:
+            return await base.get(key)
+
+    keys = list(set(keys))
+    results = await asyncio.gather(*(get(key) for key in keys))
+    return { key: item for key, item in zip(keys, results) if item }
+
+async def __base_get_products(ids) -> dict[str, Product]:
+    return { key: Product(**data) for key, data in (await __base_get_items(products_base, ids)).items() }
+
+async def __base_join_products(trackers: list[dict]) -> list[PriceTracker]:
+    products_by_id = await __base_get_products(tracker["product_id"] for tracker in trackers)
+    for tracker in trackers:
+        if product := products_by_id.get(tracker["product_id"]):
+            tracker["product"] = product
+    return [PriceTracker(**tracker) for tracker in trackers]
+
 async def __base_track_by_user(user_id: int) -> list[PriceTracker]:
     try:
-        res = await price_trackers_base.fetch({ "user_id": user_id })
-        for tracker in res.items:
-            if product_data := await products_base.get(tracker["product_id"]):
-                tracker["product"] = Product(**product_data)
-        return [PriceTracker(**tracker) for tracker in res.items]
+        return await __base_join_products(await __base_fetch_all(price_trackers_base, { "user_id": user_id }))
 
     except Exception as e:
         logger.error(f"Error fetching products: {str(e)}")
@@ -53,11 +123,7 @@ async def __prisma_track_by_user(user_id: int) -> list[PriceTracker]:
 
 async def __base_track_by_product(product_id: str) -> list[PriceTracker]:
     try:
-        res = await price_trackers_base.fetch({ "product_id": product_id })
-        for tracker in res.items:
-            if product_data := await products_base.get(tracker["product_id"]):
-                tracker["product"] = Product(**product_data)
-        return [PriceTracker(**tracker) for tracker in res.items]
+        return await __base_join_products(await __base_fetch_all(price_trackers_base, { "product_id": product_id }))
 
     except Exception as e:
         logger.error(f"Error fetching product: {str(e)}")
@@ -71,6 +137,27 @@ async def __prisma_track_by_product(product_id: str) -> list[PriceTracker]:
         logger.error(f"Error fetching product: {str(e)}")
         return []
 
+async def __base_track_by_products(product_ids: list[str]) -> list[PriceTracker]:
+    try:
+        trackers: list[PriceTracker] = []
+        # A list query is an OR over its items, chunked to keep requests small
+        for chunk in __chunks(list(product_ids), DB_BATCH_SIZE):
+            items = await __base_fetch_all(price_trackers_base, [{ "product_id": product_id } for product_id in chunk])
+            trackers.extend(PriceTracker(**tracker) for tracker in items)
+        return trackers
+
+    except Exception as e:
+        logger.error(f"Error fetching trackers: {str(e)}")
+        return []
+
+async def __prisma_track_by_products(product_ids: list[str]) -> list[PriceTracker]:
+    try:
+        return await price_trackers.find_many(where={ "product_id": { "in": list(product_ids) } })
+
+    except Exception as e:
+        logger.error(f"Error fetching trackers: {str(e)}")
+        return []
+
 async def __base_get_tracker(tracker_id: str):
     try:
         if tracker := await price_trackers_base.get(tracker_id):
@@ -91,14 +178,27 @@ async def __prisma_get_tracker(tracker_id: str):
         logger.error(f"Error fetching product: {str(e)}")
         return None
 
-async def __base_add_tracker(user_id: int, product_name: str, product_url: str, initial_price: float):
+async def __base_refresh_watchers(product_id: str):
+    watchers = len(await __base_fetch_all(price_trackers_base, { "product_id": product_id }))
+    await products_base.update({ "watchers": watchers }, product_id)
+
+async def __prisma_refresh_watchers(product_id: str):
+    # Recounted rather than incremented so older products without the field converge
+    watchers = await price_trackers.count(where={ "product_id": product_id })
+    await products.update({ "watchers": watchers }, where={ "id": product_id })
+
+async def __base_add_tracker(user_id: int, product_name: str, product_url: str, initial_price: float, product_key: Optional[str] = None):
     try:
-        res = await products_base.fetch({ "product_name": product_name })
+        res = await products_base.fetch({ "product_key": product_key }) if product_key else None
+        if not res or res.count == 0:
+            # Products stored before canonical keys existed are matched by name
+            res = await products_base.fetch({ "product_name": product_name })
         if res.count == 0:
             key = str(ObjectId())
             existing_product = Product(**{
                 "id": key,
                 "product_name": product_name,
+                "product_key": product_key,
                 "url": product_url,
                 "price": initial_price,
                 "previous_price": initial_price,
@@ -107,8 +207,12 @@ async def __base_add_tracker(user_id: int, product_name: str, product_url: str,
                 "updated_at": datetime.now(timezone)
             })
             await products_base.put(json.loads(existing_product.model_dump_json()), key)
+            await __base_append_price_history([(key, initial_price)])
         else:
             existing_product = Product(**res.items[0])
+            if product_key and not existing_product.product_key:
+                existing_product.product_key = product_key
+                await products_base.update({ "product_key": product_key }, existing_product.id)
 
         tracker_res = await price_trackers_base.fetch({ "user_id": user_id, "product_id": existing_product.id })
         if tracker_res.count > 0:
@@ -121,6 +225,7 @@ async def __base_add_tracker(user_id: int, product_name: str, product_url: str,
             "user_id": user_id,
             "product_id": existing_product.id
         }).model_dump(), key)
+        await __base_refresh_watchers(existing_product.id)
 
         if tracker:
             logger.info("Product added successfully.")
@@ -130,12 +235,18 @@ async def __base_add_tracker(user_id: int, product_name: str, product_url: str,
         logger.error(f"Error adding product: {str(e)}", exc_info=True)
         return None
 
-async def __prisma_add_tracker(user_id: int, product_name: str, product_url: str, initial_price: float):
+async def __prisma_add_tracker(user_id: int, product_name: str, product_url: str, initial_price: float, product_key: Optional[str] = None):
     try:
-        existing_product = await products.find_first(where={ "product_name": product_name })
+        existing_product = await products.find_first(where={ "product_key": product_key }) if product_key else None
+        if not existing_product:
+            # Products stored before canonical keys existed are matched by name
+            existing_product = await products.find_first(where={ "product_name": product_name })
+            if existing_product and product_key and not existing_product.product_key:
+                existing_product = await products.update({ "product_key": product_key }, where={ "id": existing_product.id })
         if not existing_product:
             new_product = ProductCreateInput({
                 "product_name": product_name,
+                "product_key": product_key,
                 "url": product_url,
                 "price": initial_price,
                 "previous_price": initial_price,
@@ -143,6 +254,7 @@ async def __prisma_add_tracker(user_id: int, product_name: str, product_url: str
                 "lower": initial_price,
             })
             existing_product = await products.create(data=new_product)
+            await __prisma_append_price_history([(existing_product.id, initial_price)])
 
         tracker = await price_trackers.find_first(
             where={ "user_id": user_id, "product_id": existing_product.id }
@@ -156,6 +268,7 @@ async def __prisma_add_tracker(user_id: int, product_name: str, product_url: str
             "user_id": user_id,
             "product_id": existing_product.id,
         })
+        await __prisma_refresh_watchers(existing_product.id)
 
         logger.info("Product added successfully.")
         return tracker
@@ -222,12 +335,414 @@ async def __prisma_update_product_price(id: str, new_price: float):
         logger.error(f"Error updating product price: {str(e)}")
 
 
+def price_update(product: Product, new_price: float) -> dict:
+    """Fields to write when `product` moves to `new_price`."""
+    return {
+        "previous_price": product.price,
+        "price": new_price,
+        "upper": max(product.upper, new_price),
+        "lower": min(product.lower, new_price),
+    }
+
+async def __base_update_products(updates: list[tuple[Product, dict]], leased: bool = False) -> list[Product]:
+    """With `leased` a product whose lease another worker took over is left alone, checked by reading it back first."""
+    updated_products: list[Product] = []
+    for chunk in __chunks(updates, DB_BATCH_SIZE):
+        try:
+            if leased:
+                stored = await __base_get_products(product.id for product, _ in chunk)
+                chunk = [(product, fields) for product, fields in chunk
+                         if product.id in stored and stored[product.id].lease_owner == product.lease_owner]
+            chunk_products = [product.model_copy(update={ **fields, "updated_at": datetime.now(timezone) }) for product, fields in chunk]
+            await products_base.put_many([
+                { **json.loads(product.model_dump_json(exclude={ "price_trackers" })), "key": product.id }
+                for product in chunk_products
+            ])
+            updated_products.extend(chunk_products)
+        except Exception as e:
+            logger.error(f"Error updating products: {str(e)}")
+
+    logger.info(f"Updated {len(updated_products)} products.")
+    return updated_products
+
+async def __prisma_update_products(updates: list[tuple[Product, dict]], leased: bool = False) -> list[Product]:
+    """
+    Writes each product's fields in batches. With `leased` a product is only
+    written while it is still leased to the token it was claimed with, so a
+    worker that outlived its lease never overwrites the newer results of the
+    one that took over; those products are left out of the result.
+    """
+    updated_products: list[Product] = []
+    for chunk in __chunks(updates, DB_BATCH_SIZE):
+        try:
+            if leased:
+                held = await products.find_many(where={ "OR": [{ "id": product.id, "lease_owner": product.lease_owner } for product, _ in chunk] })
+                held_ids = { product.id for product in held }
+                chunk = [(product, fields) for product, fields in chunk if product.id in held_ids]
+            async with prisma_db.batch_() as batcher:
+                for product, fields in chunk:
+                    if leased:
+                        # Still conditional, the lease may run out between the check and the write
+                        batcher.product.update_many(data=fields, where={ "id": product.id, "lease_owner": product.lease_owner })
+                    else:
+                        batcher.product.update(data=fields, where={ "id": product.id })
+            updated_products.extend(product.model_copy(update={ **fields, "updated_at": datetime.now(timezone) }) for product, fields in chunk)
+        except Exception as e:
+            logger.error(f"Error updating products: {str(e)}")
+
+    logger.info(f"Updated {len(updated_products)} products.")
+    return updated_products
+
+
+
+def __day_start(at: datetime) -> datetime:
+    return at.astimezone(timezone).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def __daily_buckets(points: list[PriceHistory]) -> list[dict]:
+    """Collapses change points into one min/max/last bucket per product and day."""
+    buckets: dict[tuple[str, datetime], dict] = {}
+    for point in sorted(points, key=lambda point: point.at):
+        day = __day_start(point.at)
+        if bucket := buckets.get((point.product_id, day)):
+            bucket["min"] = min(bucket["min"], point.min)
+            bucket["max"] = max(bucket["max"], point.max)
+            bucket["price"] = point.price
+        else:
+            buckets[(point.product_id, day)] = {
+                "product_id": point.product_id,
+                "at": day,
+                "price": point.price,
+                "min": point.min,
+                "max": point.max,
+                "daily": True,
+            }
+    return list(buckets.values())
+
+def __history_cutoffs() -> tuple[datetime, datetime]:
+    today = __day_start(datetime.now(timezone))
+    return today - timedelta(days=HISTORY_RAW_DAYS), today - timedelta(days=HISTORY_RETENTION_DAYS)
+
+def __base_history_item(item: dict) -> PriceHistory:
+    return PriceHistory(**{ **item, "id": item["key"], "at": datetime.fromtimestamp(item["at"], timezone) })
+
+async def __base_append_price_history(points: list[tuple[str, float]]):
+    try:
+        now = datetime.now(timezone).timestamp()
+        for chunk in __chunks(points, DB_BATCH_SIZE):
+            await price_history_base.put_many([
+                { "key": str(ObjectId()), "product_id": product_id, "at": now, "price": price, "min": price, "max": price, "daily": False }
+                for product_id, price in chunk
+            ])
+    except Exception as e:
+        logger.error(f"Error appending price history: {str(e)}")
+
+async def __prisma_append_price_history(points: list[tuple[str, float]]):
+    try:
+        now = datetime.now(timezone)
+        for chunk in __chunks(points, DB_BATCH_SIZE):
+            await price_history.create_many(data=[
+                { "product_id": product_id, "at": now, "price": price, "min": price, "max": price }
+                for product_id, price in chunk
+            ])
+    except Exception as e:
+        logger.error(f"Error appending price history: {str(e)}")
+
+async def __base_compact_price_history(product_ids: list[str]):
+    raw_cutoff, retention_cutoff = __history_cutoffs()
+    semaphore = asyncio.Semaphore(DETA_FETCH_CONCURRENCY)
+
+    async def delete(key: str):
+        async with semaphore:
+            await price_history_base.delete(key)
+
+    try:
+        for product_id in product_ids:
+            items = await __base_fetch_all(price_history_base, { "product_id": product_id, "at?lt": raw_cutoff.timestamp() })
+            expired = [item["key"] for item in items if item["at"] < retention_cutoff.timestamp()]
+            raw_points = [__base_history_item(item) for item in items if not item["daily"] and item["at"] >= retention_cutoff.timestamp()]
+            if buckets := __daily_buckets(raw_points):
+                await price_history_base.put_many([
+                    { **bucket, "key": str(ObjectId()), "at": bucket["at"].timestamp() } for bucket in buckets
+                ])
+            await asyncio.gather(*(delete(key) for key in expired + [point.id for point in raw_points]))
+    except Exception as e:
+        logger.error(f"Error compacting price history: {str(e)}")
+
+async def __prisma_compact_price_history(product_ids: list[str]):
+    raw_cutoff, retention_cutoff = __history_cutoffs()
+    try:
+        for chunk in __chunks(list(product_ids), DB_BATCH_SIZE):
+            raw_points = await price_history.find_many(where={
+                "product_id": { "in": chunk },
+                "daily": False,
+                "at": { "lt": raw_cutoff, "gte": retention_cutoff },
+            })
+            async with prisma_db.batch_() as batcher:
+                for bucket in __daily_buckets(raw_points):
+                    batcher.pricehistory.create(data=bucket)
+                if raw_points:
+                    batcher.pricehistory.delete_many(where={ "id": { "in": [point.id for point in raw_points] } })
+                batcher.pricehistory.delete_many(where={ "product_id": { "in": chunk }, "at": { "lt": retention_cutoff } })
+    except Exception as e:
+        logger.error(f"Error compacting price history: {str(e)}")
+
+async def __base_get_price_history(product_id: str, since: datetime, until: Optional[datetime] = None) -> list[PriceHistory]:
+    try:
+        query = { "product_id": product_id, "at?r": [since.timestamp(), (until or datetime.now(timezone)).timestamp()] }
+        items = await __base_fetch_all(price_history_base, query)
+        return sorted((__base_history_item(item) for item in items), key=lambda point: point.at)
+
+    except Exception as e:
+        logger.error(f"Error fetching price history: {str(e)}")
+        return []
+
+async def __prisma_get_price_history(product_id: str, since: datetime, until: Optional[datetime] = None) -> list[PriceHistory]:
+    try:
+        return await price_history.find_many(
+            where={ "product_id": product_id, "at": { "gte": since, "lte": until or datetime.now(timezone) } },
+            order={ "at": "asc" }
+        )
+
+    except Exception as e:
+        logger.error(f"Error fetching price history: {str(e)}")
+        return []
+
+async def __base_queue_notifications(messages: list[tuple[int, str]], owner: str, lease_seconds: float) -> list[str]:
+    try:
+        now = datetime.now(timezone)
+        lease = { "lease_owner": owner, "lease_until": (now + timedelta(seconds=lease_seconds)).timestamp() }
+        ids = [str(ObjectId()) for _ in messages]
+        for chunk in __chunks(list(zip(ids, messages)), DB_BATCH_SIZE):
+            await notifications_base.put_many([
+                { "key": id, "user_id": user_id, "text": text, "created_at": now.timestamp(), "deliver_after": None, **lease }
+                for id, (user_id, text) in chunk
+            ])
+        return ids
+
+    except Exception as e:
+        logger.error(f"Error queueing notifications: {str(e)}")
+        return []
+
+async def __prisma_queue_notifications(messages: list[tuple[int, str]], owner: str, lease_seconds: float) -> list[str]:
+    try:
+        now = datetime.now(timezone)
+        # Ids are generated here, create_many does not return them
+        ids = [str(ObjectId()) for _ in messages]
+        for chunk in __chunks(list(zip(ids, messages)), DB_BATCH_SIZE):
+            await notifications.create_many(data=[
+                {
+                    "id": id, "user_id": user_id, "text": text, "created_at": now,
+                    "lease_owner": owner, "lease_until": now + timedelta(seconds=lease_seconds),
+                }
+                for id, (user_id, text) in chunk
+            ])
+        return ids
+
+    except Exception as e:
+        logger.error(f"Error queueing notifications: {str(e)}")
+        return []
+
+def __base_notification(item: dict) -> Notification:
+    lease_until, deliver_after = item.get("lease_until"), item.get("deliver_after")
+    return Notification(
+        id=item["key"],
+        user_id=item["user_id"],
+        text=item["text"],
+        created_at=datetime.fromtimestamp(item["created_at"], timezone),
+        lease_owner=item.get("lease_owner"),
+        lease_until=datetime.fromtimestamp(lease_until, timezone) if lease_until else None,
+        deliver_after=datetime.fromtimestamp(deliver_after, timezone) if deliver_after else None,
+    )
+
+async def __base_claim_notifications(owner: str, lease_seconds: float, limit: int, ids: Optional[list[str]] = None) -> list[Notification]:
+    """Like __base_claim_due_products, leases are written and read back, which is not atomic."""
+    try:
+        now = datetime.now(timezone).timestamp()
+        if ids is None:
+            candidates: list[dict] = []
+            # Every combination of a free lease and a passed or unset hold
+            query = [{ **lease, **hold } for lease in ({ "lease_until?lt": now }, { "lease_until": None })
+                     for hold in ({ "deliver_after?lt": now }, { "deliver_after": None })]
+            async for page in __base_iter_pages(notifications_base, query):
+                candidates = heapq.nsmallest(limit, candidates + page, key=lambda item: item["created_at"])
+        else:
+            candidates = [item for item in (await __base_get_items(notifications_base, ids)).values()
+                          if item.get("lease_owner") == owner or not item.get("lease_until") or item["lease_until"] < now]
+        lease = { "lease_owner": owner, "lease_until": now + lease_seconds }
+        for chunk in __chunks(candidates, DB_BATCH_SIZE):
+            await notifications_base.put_many([{ **item, **lease } for item in chunk])
+        confirmed = await __base_get_items(notifications_base, [item["key"] for item in candidates])
+        claimed = [__base_notification(item) for item in confirmed.values() if item.get("lease_owner") == owner]
+        return sorted(claimed, key=lambda message: message.created_at)
+
+    except Exception as e:
+        logger.error(f"Error claiming notifications: {str(e)}")
+        return []
+
+async def __prisma_claim_notifications(owner: str, lease_seconds: float, limit: int, ids: Optional[list[str]] = None) -> list[Notification]:
+    """
+    Leases outbox entries to `owner`: the oldest `limit` entries nobody holds
+    and not held back until later, or of `ids` the ones still held by `owner`
+    or by nobody. The conditional
+    update_many is atomic per document, so two runs never send the same entry.
+    """
+    try:
+        now = datetime.now(timezone)
+        free = { "NOT": [{ "lease_until": { "gt": now } }] }
+        if ids is None:
+            due = { "AND": [free, { "NOT": [{ "deliver_after": { "gt": now } }] }] }
+            candidates = [message.id for message in await notifications.find_many(where=due, order={ "created_at": "asc" }, take=limit)]
+        else:
+            candidates = ids
+        if not candidates:
+            return []
+
+        await notifications.update_many(
+            where={ "AND": [{ "id": { "in": candidates } }, { "OR": [{ "lease_owner": owner }, free] }] },
+            data={ "lease_owner": owner, "lease_until": now + timedelta(seconds=lease_seconds) },
+        )
+        return await notifications.find_many(where={ "id": { "in": candidates }, "lease_owner": owner }, order={ "created_at": "asc" })
+
+    except Exception as e:
+        logger.error(f"Error claiming notifications: {str(e)}")
+        return []
+
+async def __base_release_notifications(ids: list[str], until: Optional[datetime] = None):
+    semaphore = asyncio.Semaphore(DETA_FETCH_CONCURRENCY)
+    data = { "lease_owner": None, "lease_until": None }
+    if until:
+        data["deliver_after"] = until.timestamp()
+
+    async def release(key: str):
+        async with semaphore:
+            await notifications_base.update(data, key)
+
+    try:
+        await asyncio.gather(*(release(id) for id in ids))
+    except Exception as e:
+        logger.error(f"Error releasing notifications: {str(e)}")
+
+async def __prisma_release_notifications(ids: list[str], until: Optional[datetime] = None):
+    """Drops the lease on outbox entries, with `until` they are also skipped by claims before then."""
+    try:
+        if ids:
+            data = { "lease_owner": None, "lease_until": None }
+            if until:
+                data["deliver_after"] = until
+            await notifications.update_many(where={ "id": { "in": ids } }, data=data)
+    except Exception as e:
+        logger.error(f"Error releasing notifications: {str(e)}")
+
+async def __base_delete_notifications(ids: list[str]):
+    semaphore = asyncio.Semaphore(DETA_FETCH_CONCURRENCY)
+
+    async def delete(key: str):
+        async with semaphore:
+            await notifications_base.delete(key)
+
+    try:
+        await asyncio.gather(*(delete(id) for id in ids))
+    except Exception as e:
+        logger.error(f"Error deleting notifications: {str(e)}")
+
+async def __prisma_delete_notifications(ids: list[str]):
+    try:
+        if ids:
+            await notifications.delete_many(where={ "id": { "in": ids } })
+    except Exception as e:
+        logger.error(f"Error deleting notifications: {str(e)}")
+
+def __base_user_settings(item: dict) -> UserSettings:
+    last_digest_at = item.get("last_digest_at")
+    return UserSettings(**{
+        **item,
+        "id": item["key"],
+        "last_digest_at": datetime.fromtimestamp(last_digest_at, timezone) if last_digest_at else None,
+    })
+
+async def __base_get_user_settings(user_ids: list[int]) -> dict[int, UserSettings]:
+    semaphore = asyncio.Semaphore(DETA_FETCH_CONCURRENCY)
+
+    async def get(user_id: int):
+        async with semaphore:
+            return await user_settings_base.get(str(user_id))
+
+    try:
+        keys = list(set(user_ids))
+        results = await asyncio.gather(*(get(user_id) for user_id in keys))
+        return { user_id: __base_user_settings(item) for user_id, item in zip(keys, results) if item }
+
+    except Exception as e:
+        logger.error(f"Error fetching user settings: {str(e)}")
+        return {}
+
+async def __prisma_get_user_settings(user_ids: list[int]) -> dict[int, UserSettings]:
+    try:
+        if not user_ids:
+            return {}
+        found = await user_settings.find_many(where={ "user_id": { "in": list(set(user_ids)) } })
+        return { settings.user_id: settings for settings in found }
+
+    except Exception as e:
+        logger.error(f"Error fetching user settings: {str(e)}")
+        return {}
+
+async def __base_save_user_settings(user_id: int, **fields) -> Optional[UserSettings]:
+    try:
+        item = await user_settings_base.get(str(user_id)) or { "key": str(user_id), "user_id": user_id, "digest_minutes": 0 }
+        item.update(fields)
+        if isinstance(item.get("last_digest_at"), datetime):
+            item["last_digest_at"] = item["last_digest_at"].timestamp()
+        await user_settings_base.put(item)
+        # Entries held under the old settings are rechecked on the next run
+        for held in await __base_fetch_all(notifications_base, { "user_id": user_id, "deliver_after?ne": None }):
+            await notifications_base.update({ "deliver_after": None }, held["key"])
+        return __base_user_settings(item)
+
+    except Exception as e:
+        logger.error(f"Error saving user settings: {str(e)}")
+        return None
+
+async def __prisma_save_user_settings(user_id: int, **fields) -> Optional[UserSettings]:
+    try:
+        settings = await user_settings.upsert(
+            where={ "user_id": user_id },
+            data={ "create": { "user_id": user_id, **fields }, "update": fields },
+        )
+        # Entries held under the old settings are rechecked on the next run
+        await notifications.update_many(where={ "user_id": user_id }, data={ "deliver_after": None })
+        return settings
+
+    except Exception as e:
+        logger.error(f"Error saving user settings: {str(e)}")
+        return None
+
+async def __base_mark_digests_sent(user_ids: list[int], at: datetime):
+    semaphore = asyncio.Semaphore(DETA_FETCH_CONCURRENCY)
+
+    async def mark(user_id: int):
+        async with semaphore:
+            await user_settings_base.update({ "last_digest_at": at.timestamp() }, str(user_id))
+
+    try:
+        await asyncio.gather(*(mark(user_id) for user_id in user_ids))
+    except Exception as e:
+        logger.error(f"Error marking digests sent: {str(e)}")
+
+async def __prisma_mark_digests_sent(user_ids: list[int], at: datetime):
+    try:
+        if user_ids:
+            await user_settings.update_many(where={ "user_id": { "in": user_ids } }, data={ "last_digest_at": at })
+    except Exception as e:
+        logger.error(f"Error marking digests sent: {str(e)}")
+
 async def __base_delete_tracker(id: str, user_id: int):
     try:
         if tracker_data := await price_trackers_base.get(id):
             tracker = PriceTracker(**tracker_data)
             if tracker.user_id == user_id:
                 await price_trackers_base.delete(id)
+                await __base_refresh_watchers(tracker.product_id)
                 return True
             else:
                 return False
@@ -242,6 +757,7 @@ async def __prisma_delete_tracker(id: str, user_id: int):
     try:
         if tracker := await price_trackers.find_first(where={ "id": id, "user_id": user_id }):
             await price_trackers.delete({ "id": tracker.id })
+            await __prisma_refresh_watchers(tracker.product_id)
             return True
         else:
             return False
@@ -253,17 +769,14 @@ async def __prisma_delete_tracker(id: str, user_id: int):
 
 async def __base_all_products(include_trackers: bool = False) -> list[Product]:
     try:
-        products_res = await products_base.fetch()
-        products: list[Product] = []
+        products = [Product(**product) for product in await __base_fetch_all(products_base)]
 
-        for product in products_res.items:
-            product = Product(**product)
-            if include_trackers:
-                product.price_trackers = []
-                trackers_res = await price_trackers_base.fetch({ "product_id": product.id })
-                for tracker in trackers_res.items:
-                    product.price_trackers.append(PriceTracker(**tracker))
-            products.append(product)
+        if include_trackers:
+            trackers_by_product: dict[str, list[PriceTracker]] = {}
+            for tracker in await __base_fetch_all(price_trackers_base):
+                trackers_by_product.setdefault(tracker["product_id"], []).append(PriceTracker(**tracker))
+            for product in products:
+                product.price_trackers = trackers_by_product.get(product.id, [])
 
         return products
 
@@ -278,10 +791,213 @@ async def __prisma_all_products(include_trackers: bool = False) -> list[Product]
         logger.error(f"Error fetching products: {str(e)}")
         return []
 
-track_by_user = __base_track_by_user if DETA_APP else __prisma_track_by_user
-track_by_product = __base_track_by_product if DETA_APP else __prisma_track_by_product
-get_tracker = __base_get_tracker if DETA_APP else __prisma_get_tracker
-add_tracker = __base_add_tracker if DETA_APP else __prisma_add_tracker
-update_product_price = __base_update_product_price if DETA_APP else __prisma_update_product_price
-delete_tracker = __base_delete_tracker if DETA_APP else __prisma_delete_tracker
-all_products = __base_all_products if DETA_APP else __prisma_all_products
\ No newline at end of file
+async def __base_due_products(limit: int) -> list[Product]:
+    try:
+        now = datetime.now(timezone)
+        due: list[dict] = []
+        # ISO timestamps in one timezone compare correctly as strings; only the
+        # `limit` earliest are kept while paging so memory stays bounded
+        async for page in __base_iter_pages(products_base, [{ "next_check_at?lte": now.isoformat() }, { "next_check_at": None }]):
+            due = heapq.nsmallest(limit, due + page, key=lambda item: item.get("next_check_at") or "")
+        return [Product(**item) for item in due]
+
+    except Exception as e:
+        logger.error(f"Error fetching due products: {str(e)}")
+        return []
+
+async def __prisma_due_products(limit: int) -> list[Product]:
+    try:
+        # NOT gt (rather than lte) also matches products never scheduled, where the field is unset
+        return await products.find_many(
+            where={ "NOT": [{ "next_check_at": { "gt": datetime.now(timezone) } }] },
+            order={ "next_check_at": "asc" },
+            take=limit,
+        )
+    except Exception as e:
+        logger.error(f"Error fetching due products: {str(e)}")
+        return []
+
+async def __base_claim_due_products(worker_id: str, limit: int, lease_seconds: float) -> tuple[list[Product], int]:
+    """
+    Deta Base has no conditional writes, so leases are written and then read
+    back to drop products another worker took in between. This narrows the
+    race but is not atomic; run a single sweeper on Deta.
+    """
+    try:
+        now = datetime.now(timezone)
+        token = f"{worker_id}:{ObjectId()}"
+        due = [product for product in await __base_due_products(limit * 2) if not product.lease_until or product.lease_until <= now][:limit]
+        leased = [product.model_copy(update={ "lease_owner": token, "lease_until": now + timedelta(seconds=lease_seconds) }) for product in due]
+        for chunk in __chunks(leased, DB_BATCH_SIZE):
+            await products_base.put_many([
+                { **json.loads(product.model_dump_json(exclude={ "price_trackers" })), "key": product.id } for product in chunk
+            ])
+        confirmed = await __base_get_products(product.id for product in leased)
+        return [product for product in confirmed.values() if product.lease_owner == token], len(due)
+
+    except Exception as e:
+        logger.error(f"Error claiming products: {str(e)}")
+        return [], 0
+
+async def __base_renew_product_leases(products: list[Product], lease_seconds: float):
+    try:
+        lease_until = (datetime.now(timezone) + timedelta(seconds=lease_seconds)).timestamp()
+        stored = await __base_get_products(product.id for product in products)
+        for product in products:
+            if product.id in stored and stored[product.id].lease_owner == product.lease_owner:
+                await products_base.update({ "lease_until": lease_until }, product.id)
+    except Exception as e:
+        logger.error(f"Error renewing product leases: {str(e)}")
+
+async def __prisma_renew_product_leases(products: list[Product], lease_seconds: float):
+    """Extends the leases of claimed products this worker still holds, while a slow batch is checked."""
+    try:
+        tokens = { product.lease_owner for product in products }
+        await products.update_many(
+            where={ "id": { "in": [product.id for product in products] }, "lease_owner": { "in": list(tokens) } },
+            data={ "lease_until": datetime.now(timezone) + timedelta(seconds=lease_seconds) },
+        )
+    except Exception as e:
+        logger.error(f"Error renewing product leases: {str(e)}")
+
+async def __prisma_claim_due_products(worker_id: str, limit: int, lease_seconds: float) -> tuple[list[Product], int]:
+    """
+    Leases up to `limit` due products to this worker. The conditional
+    update_many is atomic per document, so concurrent workers never get the
+    same product; leases that expire (a worker died) become claimable again.
+
+    Returns the claimed products and how many were due when the claim
+    started. No products out of several candidates means other workers won
+    the race, not that the queue is empty.
+    """
+    try:
+        now = datetime.now(timezone)
+        token = f"{worker_id}:{ObjectId()}"
+        unleased = { "NOT": [{ "lease_until": { "gt": now } }] }
+        candidates = await products.find_many(
+            where={ "AND": [{ "NOT": [{ "next_check_at": { "gt": now } }] }, unleased] },
+            order={ "next_check_at": "asc" },
+            take=limit,
+        )
+        if not candidates:
+            return [], 0
+
+        await products.update_many(
+            where={ "AND": [{ "id": { "in": [product.id for product in candidates] } }, unleased] },
+            data={ "lease_owner": token, "lease_until": now + timedelta(seconds=lease_seconds) },
+        )
+        return await products.find_many(where={ "lease_owner": token }), len(candidates)
+
+    except Exception as e:
+        logger.error(f"Error claiming products: {str(e)}")
+        return [], 0
+
+def __query(operation: str):
+    """Times each call per operation and connects first if nothing has yet."""
+    def decorator(fn):
+        fn = timed(DB_SECONDS, operation=operation)(fn)
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            await connect()
+            return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+__db_track_by_user = __query("track_by_user")(__base_track_by_user if DETA_APP else __prisma_track_by_user)
+track_by_product = __query("track_by_product")(__base_track_by_product if DETA_APP else __prisma_track_by_product)
+track_by_products = __query("track_by_products")(__base_track_by_products if DETA_APP else __prisma_track_by_products)
+__db_get_tracker = __query("get_tracker")(__base_get_tracker if DETA_APP else __prisma_get_tracker)
+__db_add_tracker = __query("add_tracker")(__base_add_tracker if DETA_APP else __prisma_add_tracker)
+__db_update_product_price = __query("update_product_price")(__base_update_product_price if DETA_APP else __prisma_update_product_price)
+__db_update_products = __query("update_products")(__base_update_products if DETA_APP else __prisma_update_products)
+__db_delete_tracker = __query("delete_tracker")(__base_delete_tracker if DETA_APP else __prisma_delete_tracker)
+all_products = __query("all_products")(__base_all_products if DETA_APP else __prisma_all_products)
+due_products = __query("due_products")(__base_due_products if DETA_APP else __prisma_due_products)
+claim_due_products = __query("claim_due_products")(__base_claim_due_products if DETA_APP else __prisma_claim_due_products)
+renew_product_leases = __query("renew_product_leases")(__base_renew_product_leases if DETA_APP else __prisma_renew_product_leases)
+append_price_history = __query("append_price_history")(__base_append_price_history if DETA_APP else __prisma_append_price_history)
+compact_price_history = __query("compact_price_history")(__base_compact_price_history if DETA_APP else __prisma_compact_price_history)
+get_price_history = __query("get_price_history")(__base_get_price_history if DETA_APP else __prisma_get_price_history)
+queue_notifications = __query("queue_notifications")(__base_queue_notifications if DETA_APP else __prisma_queue_notifications)
+claim_notifications = __query("claim_notifications")(__base_claim_notifications if DETA_APP else __prisma_claim_notifications)
+release_notifications = __query("release_notifications")(__base_release_notifications if DETA_APP else __prisma_release_notifications)
+delete_notifications = __query("delete_notifications")(__base_delete_notifications if DETA_APP else __prisma_delete_notifications)
+get_user_settings = __query("get_user_settings")(__base_get_user_settings if DETA_APP else __prisma_get_user_settings)
+save_user_settings = __query("save_user_settings")(__base_save_user_settings if DETA_APP else __prisma_save_user_settings)
+mark_digests_sent = __query("mark_digests_sent")(__base_mark_digests_sent if DETA_APP else __prisma_mark_digests_sent)
+
+# Which cached entries embed a product, so a price change patches only those.
+# Entries leave it together with the cache entries, it never outgrows them
+__cached_by_product: dict[str, set[tuple[str, object]]] = {}
+
+def __index_trackers(kind: str, key, trackers: list[PriceTracker]):
+    for tracker in trackers:
+        __cached_by_product.setdefault(tracker.product_id, set()).add((kind, key))
+
+def __unindex_trackers(kind: str):
+    def unindex(key, value):
+        for tracker in value if kind == "user" else [value]:
+            if (keys := __cached_by_product.get(tracker.product_id)) is not None:
+                keys.discard((kind, key))
+                if not keys:
+                    del __cached_by_product[tracker.product_id]
+    return unindex
+
+# Tracker lists by user id and single trackers by id, both with products joined
+__user_trackers_cache = TTLCache(TRACKER_CACHE_SIZE, TRACKER_CACHE_TTL, on_evict=__unindex_trackers("user"))
+__tracker_cache = TTLCache(TRACKER_CACHE_SIZE, TRACKER_CACHE_TTL, on_evict=__unindex_trackers("tracker"))
+
+def __patch_cached_products(updated: list[Product]):
+    for product in updated:
+        for kind, key in __cached_by_product.pop(product.id, set()):
+            cache = __user_trackers_cache if kind == "user" else __tracker_cache
+            if (entry := cache.get(key)) is None:
+                continue
+            trackers = entry if kind == "user" else [entry]
+            patched = [
+                tracker.model_copy(update={ "product": product }) if tracker.product_id == product.id else tracker
+                for tracker in trackers
+            ]
+            # Expires when the original entry would, trackers changed elsewhere still show up in time
+            if cache.replace(key, patched if kind == "user" else patched[0]):
+                __index_trackers(kind, key, patched)
+
+async def track_by_user(user_id: int) -> list[PriceTracker]:
+    async def load():
+        trackers = await __db_track_by_user(user_id)
+        __index_trackers("user", user_id, trackers)
+        return trackers
+    return await __user_trackers_cache.get_or_load(user_id, load)
+
+async def get_tracker(tracker_id: str):
+    async def load():
+        if tracker := await __db_get_tracker(tracker_id):
+            __index_trackers("tracker", tracker_id, [tracker])
+        return tracker
+    return await __tracker_cache.get_or_load(tracker_id, load, cacheable=lambda tracker: tracker is not None)
+
+async def add_tracker(user_id: int, product_name: str, product_url: str, initial_price: float, product_key: Optional[str] = None):
+    tracker = await __db_add_tracker(user_id, product_name, product_url, initial_price, product_key)
+    __user_trackers_cache.pop(user_id)
+    return tracker
+
+async def delete_tracker(id: str, user_id: int):
+    is_deleted = await __db_delete_tracker(id, user_id)
+    if is_deleted:
+        __user_trackers_cache.pop(user_id)
+        __tracker_cache.pop(id)
+    return is_deleted
+
+async def update_product_price(id: str, new_price: float):
+    if updated_product := await __db_update_product_price(id, new_price):
+        __patch_cached_products([updated_product])
+    return updated_product
+
+async def update_products(updates: list[tuple[Product, dict]], leased: bool = False) -> list[Product]:
+    updated_products = await __db_update_products(updates, leased)
+    __patch_cached_products(updated_products)
+    return updated_products
+
+async def update_product_prices(updates: list[tuple[Product, float]]) -> list[Product]:
+    """Batched price update for products the caller already loaded, returns the updated products."""
+    return await update_products([(product, price_update(product, new_price)) for product, new_price in updates])
@@ -0,0 +1,54 @@
+import logging
+import os
+from typing import Optional
+from aiohttp import ClientSession, ClientTimeout, DummyCookieJar, TCPConnector
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "10"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "600"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "4"))
+
+try:
+    import brotli  # noqa: F401 aiohttp decodes br only with it installed
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+__session: Optional[ClientSession] = None
+
+
+async def start_http():
+    global __session
+    if __session is None or __session.closed:
+        connector = TCPConnector(
+            limit=HTTP_POOL_SIZE,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE,
+        )
+        # Cookies are sent per request, a shared jar would leak them between users' fetches
+        __session = ClientSession(
+            connector=connector,
+            cookie_jar=DummyCookieJar(),
+            timeout=ClientTimeout(HTTP_TIMEOUT),
+            # Pages are several times smaller compressed, aiohttp inflates them while streaming
+            headers={ "Accept-Encoding": ACCEPT_ENCODING },
+        )
+        logger.info("HTTP client started.")
+    return __session
+
+async def close_http():
+    global __session
+    if __session is not None and not __session.closed:
+        await __session.close()
+        logger.info("HTTP client closed.")
+    __session = None
+
+async def get_session() -> ClientSession:
+    """Returns the app-wide pooled session, starting it if the app hooks have not run (scripts, workers)."""
+    if __session is None or __session.closed:
+        return await start_http()
+    return __session
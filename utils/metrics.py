@@ -0,0 +1,61 @@
+import functools
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# Buckets from a cached lookup to a slow page fetch
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PAGE_BYTES_BUCKETS = (16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6)
+
+SCRAPE_SECONDS = Histogram("scrape_seconds", "Product scrape latency, cache and fallbacks included", ["platform", "result"], buckets=LATENCY_BUCKETS)
+FETCH_SECONDS = Histogram("extract_fetch_seconds", "Product page download latency", ["platform"], buckets=LATENCY_BUCKETS)
+FETCH_BYTES = Histogram("extract_fetch_bytes", "Product page bytes read, after decompression", ["platform"], buckets=PAGE_BYTES_BUCKETS)
+FETCH_TRUNCATED = Counter("extract_fetch_truncated", "Page downloads stopped early, past the price marker or at the byte cap", ["platform", "reason"])
+PARSE_SECONDS = Histogram("extract_parse_seconds", "Product page parse and extraction latency", ["platform"], buckets=LATENCY_BUCKETS)
+EXTRACTIONS = Counter("extractions", "Extractor runs by outcome", ["platform", "result"])
+SCRAPE_RETRIES = Counter("scrape_retries", "Extractor retries spent from sweep retry budgets", ["platform"])
+STRUCTURED_LOOKUPS = Counter("structured_lookups", "Pages served by the structured data fast path (hit) or by selectors (miss)", ["platform", "result"])
+DB_SECONDS = Histogram("db_operation_seconds", "Database call latency", ["operation"], buckets=LATENCY_BUCKETS)
+NOTIFY_SECONDS = Histogram("notify_send_seconds", "Telegram send_message latency", buckets=LATENCY_BUCKETS)
+NOTIFICATIONS = Counter("notifications", "Price change notifications by outcome", ["result"])
+DIGEST_ENTRIES = Counter("digest_entries", "Price changes sent to users (sent) or held back by quiet hours and digest windows (held)", ["result"])
+WEBHOOK_SECONDS = Histogram("webhook_seconds", "Webhook handler latency", buckets=LATENCY_BUCKETS)
+WEBHOOK_UPDATES = Counter("webhook_updates", "Webhook updates by outcome", ["result"])
+SWEEP_SECONDS = Histogram("sweep_seconds", "Duration of a price sweep", buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800))
+SWEEP_PRODUCTS = Counter("sweep_products", "Products checked by price sweeps")
+
+
+def record_extraction(platform: str, product):
+    EXTRACTIONS.labels(platform=platform, result=extraction_result(product)).inc()
+    if product.source:
+        STRUCTURED_LOOKUPS.labels(platform=platform, result="hit" if product.source == "structured" else "miss").inc()
+
+
+def extraction_result(product) -> str:
+    if product.not_modified:
+        return "not_modified"
+    return "ok" if product.title and product.price else "empty"
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - started)
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator observing the latency of a coroutine function."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with timer(histogram, **labels):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
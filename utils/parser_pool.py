@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# "process" spreads parsing over all cores, "thread" only keeps the event loop
+# free (for hosts without multiprocessing support), "inline" parses on the loop
+PARSER_POOL = os.getenv("PARSER_POOL", "process").lower()
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", "0")) or os.cpu_count() or 1
+
+T = TypeVar("T")
+__executor: Optional[Executor] = None
+
+
+def start_parser_pool():
+    global __executor
+    if __executor is not None or PARSER_POOL == "inline":
+        return
+
+    if PARSER_POOL == "process":
+        try:
+            __executor = ProcessPoolExecutor(max_workers=PARSER_WORKERS)
+            logger.info(f"Parser pool started with {PARSER_WORKERS} processes.")
+            return
+        except (OSError, NotImplementedError) as e:
+            logger.warning(f"Process pool unavailable, falling back to threads: {str(e)}")
+
+    __executor = ThreadPoolExecutor(max_workers=PARSER_WORKERS, thread_name_prefix="parser")
+    logger.info(f"Parser pool started with {PARSER_WORKERS} threads.")
+
+def close_parser_pool():
+    global __executor
+    if __executor is not None:
+        __executor.shutdown(wait=False, cancel_futures=True)
+        __executor = None
+        logger.info("Parser pool closed.")
+
+async def run_parser(parser: Callable[..., T], *args) -> T:
+    """Runs a module-level (picklable) parser function in the worker pool."""
+    if PARSER_POOL == "inline":
+        return parser(*args)
+    if __executor is None:
+        start_parser_pool()
+    return await asyncio.get_running_loop().run_in_executor(__executor, partial(parser, *args))
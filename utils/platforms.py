@@ -0,0 +1,134 @@
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from utils.http import get_session
+from utils.throttle import host_slot
+
+logger = logging.getLogger(__name__)
+
+SHORTLINK_CACHE_SIZE = int(os.getenv("SHORTLINK_CACHE_SIZE", "4096"))
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|ref|ref_|tag|linkCode|psc|smid|spIA|th|_encoding|affid|affExtParam\d*|otracker\w*|lid|marketplace|store|srno|iid|ssid|qH|fm|ppt|ppn|fbclid|gclid)$")
+REQUEST_HEADER = { "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:112.0) Gecko/20100101 Firefox/112.0" }
+
+
+class CanonicalProduct(NamedTuple):
+    platform: str
+    key: str
+    url: str
+
+
+class Platform:
+    """
+    A supported store: which hosts belong to it, which of them are short-link
+    redirectors and how to pull a stable product id out of a resolved URL.
+    """
+    def __init__(self, name: str, hosts: list[str], key_pattern: str, short_hosts: list[str] = []):
+        self.name = name
+        self.hosts = frozenset(hosts)
+        self.short_hosts = frozenset(short_hosts)
+        self.url_pattern = r"https?://(?:" + "|".join(re.escape(host) for host in hosts) + r")/.+"
+        self.url_regex = re.compile(self.url_pattern, re.IGNORECASE)
+        self.key_regex = re.compile(key_pattern)
+
+    def matches(self, url: str) -> bool:
+        return bool(self.url_regex.match(url))
+
+    def is_short_link(self, url: str) -> bool:
+        return (urlsplit(url).hostname or "").lower() in self.short_hosts
+
+    def canonicalize(self, url: str) -> Optional[CanonicalProduct]:
+        if match := self.key_regex.search(url):
+            return CanonicalProduct(self.name, f"{self.name}:{match.group(1)}", url)
+        return None
+
+
+class AmazonPlatform(Platform):
+    def canonicalize(self, url: str):
+        if match := self.key_regex.search(url):
+            asin = match.group(1)
+            domain = "amazon.com" if (urlsplit(url).hostname or "").endswith(".com") else "amazon.in"
+            return CanonicalProduct(self.name, f"{domain}:{asin}", f"https://www.{domain}/dp/{asin}")
+        return None
+
+
+class FlipkartPlatform(Platform):
+    def canonicalize(self, url: str):
+        if match := self.key_regex.search(url):
+            pid = match.group(1)
+            path = re.sub(r"^/dl(?=/)", "", urlsplit(url).path)
+            return CanonicalProduct(self.name, f"{self.name}:{pid}", f"https://www.flipkart.com{path}?pid={pid}")
+        return None
+
+
+PLATFORMS = [
+    AmazonPlatform(
+        "amazon",
+        hosts=["www.amazon.com", "amazon.com", "m.amazon.com", "www.amazon.in", "amazon.in", "m.amazon.in", "amzn.in", "amzn.to"],
+        key_pattern=r"/(?:dp|gp/product|gp/aw/d|exec/obidos/ASIN|o/ASIN)/([A-Z0-9]{10})(?:[/?#]|$)",
+        short_hosts=["amzn.in", "amzn.to"],
+    ),
+    FlipkartPlatform(
+        "flipkart",
+        hosts=["www.flipkart.com", "flipkart.com", "m.flipkart.com", "dl.flipkart.com", "www.flipkart.in", "flipkart.in", "m.flipkart.in", "dl.flipkart.in", "fkrt.it"],
+        key_pattern=r"[?&]pid=([A-Z0-9]{16})",
+        short_hosts=["dl.flipkart.com", "dl.flipkart.in", "fkrt.it"],
+    ),
+]
+
+# Matches any URL of a supported platform, used to route incoming messages
+url_pattern = "|".join(platform.url_pattern for platform in PLATFORMS)
+
+__resolved: "OrderedDict[str, str]" = OrderedDict()
+
+
+def get_platform(url: str) -> Optional[Platform]:
+    for platform in PLATFORMS:
+        if platform.matches(url):
+            return platform
+    return None
+
+def strip_tracking(url: str) -> str:
+    parts = urlsplit(url.strip())
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(k)]
+    path = re.sub(r"/ref=[^/]*$", "", parts.path)
+    return urlunsplit((parts.scheme.lower(), (parts.hostname or "").lower(), path, urlencode(query), ""))
+
+def canonicalize(url: str) -> CanonicalProduct:
+    """Offline canonicalization, short links are keyed as-is until `resolve` follows them."""
+    url = strip_tracking(url)
+    if (platform := get_platform(url)) and (canonical := platform.canonicalize(url)):
+        return canonical
+    name = platform.name if platform else "generic"
+    parts = urlsplit(url)
+    host = re.sub(r"^(www|m)\.", "", parts.netloc)
+    return CanonicalProduct(name, f"{name}:{host}{parts.path}" + (f"?{parts.query}" if parts.query else ""), url)
+
+async def __follow_redirects(url: str) -> str:
+    session = await get_session()
+    async with host_slot(url) as slot, session.get(url, headers=REQUEST_HEADER, allow_redirects=True) as res:
+        slot.record(res.status)
+        return str(res.url)
+
+async def resolve(url: str) -> CanonicalProduct:
+    """Canonicalizes a URL, following short-link redirects once and caching where they lead."""
+    url = url.strip()
+    platform = get_platform(url)
+    # Deep links that already carry the product id need no round trip
+    if platform and platform.is_short_link(url) and not platform.canonicalize(url):
+        if (target := __resolved.get(url)) is not None:
+            __resolved.move_to_end(url)
+        else:
+            try:
+                target = await __follow_redirects(url)
+            except Exception as e:
+                logger.warning(f"Could not resolve short link {url}: {str(e)}")
+                return canonicalize(url)
+            __resolved[url] = target
+            if len(__resolved) > SHORTLINK_CACHE_SIZE:
+                __resolved.popitem(last=False)
+        url = target
+    return canonicalize(url)
@@ -0,0 +1,90 @@
+import logging
+import os
+import random
+import time
+from typing import Optional
+
+from utils.throttle import host_key
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failed or empty extractions that open a host's circuit, and how
+# long it stays open before a single probe request is let through
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "120"))
+# Retries of a timed out extraction, spaced by jittered exponential backoff
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "2"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """
+    Fails requests to a host fast once it keeps failing. After `threshold`
+    consecutive failures the circuit opens; after `cooldown` seconds one
+    request is allowed through as a probe, and its outcome closes the
+    circuit or opens it for another cooldown.
+    """
+    def __init__(self, host: str, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self._opened_at < self.cooldown:
+            # Open, or half-open with the probe still out
+            return False
+        if self.state == OPEN:
+            logger.info(f"Probing {self.host} after {self.cooldown:.0f}s open")
+        # A probe that never reported back (cancelled) is replaced after another cooldown
+        self.state = HALF_OPEN
+        self._opened_at = now
+        return True
+
+    def success(self):
+        if self.state != CLOSED:
+            logger.info(f"Closing circuit for {self.host}")
+        self.state = CLOSED
+        self.failures = 0
+
+    def failure(self, reason: str):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+            logger.warning(f"Opening circuit for {self.host} for {self.cooldown:.0f}s after {self.failures} failures ({reason})")
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Retries one sweep may spend in total, so a struggling host cannot double its load."""
+    def __init__(self, retries: int):
+        self.remaining = retries
+
+    def take(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+def retry_delay(attempt: int) -> float:
+    """Full jitter: uniform between zero and the exponential backoff."""
+    return random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt)
+
+
+__breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    key = host_key(url)
+    breaker: Optional[CircuitBreaker] = __breakers.get(key)
+    if breaker is None:
+        breaker = __breakers[key] = CircuitBreaker(key)
+    return breaker
@@ -0,0 +1,64 @@
+import math
+import os
+import random
+from datetime import datetime, timedelta
+
+# Bounds for the time between two checks of the same product
+CHECK_INTERVAL_MIN = timedelta(minutes=float(os.getenv("CHECK_INTERVAL_MIN_MINUTES", "30")))
+CHECK_INTERVAL_MAX = timedelta(hours=float(os.getenv("CHECK_INTERVAL_MAX_HOURS", "24")))
+# How fast old price changes stop counting towards a product's volatility
+VOLATILITY_HALF_LIFE_DAYS = float(os.getenv("VOLATILITY_HALF_LIFE_DAYS", "7"))
+# Aim for this many expected price changes between two checks
+TARGET_CHANGES_PER_CHECK = float(os.getenv("TARGET_CHANGES_PER_CHECK", "0.5"))
+# Products that have not moved for this long are checked half as often
+STALE_AFTER = timedelta(days=float(os.getenv("STALE_AFTER_DAYS", "30")))
+
+
+def update_volatility(volatility: float, elapsed: timedelta, changed: bool) -> float:
+    """Exponentially decayed estimate of price changes per day."""
+    tau = VOLATILITY_HALF_LIFE_DAYS / math.log(2)
+    decayed = volatility * math.exp(-elapsed.total_seconds() / 86400 / tau)
+    return decayed + (1 / tau if changed else 0)
+
+
+def check_interval(volatility: float, watchers: int, since_change: timedelta) -> timedelta:
+    if volatility > 0:
+        interval = min(CHECK_INTERVAL_MAX, timedelta(days=TARGET_CHANGES_PER_CHECK / volatility))
+    else:
+        interval = CHECK_INTERVAL_MAX
+    # Popular products are checked more often, logarithmically in their watchers
+    interval /= 1 + math.log2(max(watchers, 1))
+    if since_change > STALE_AFTER:
+        interval *= 2
+    # Jitter keeps products added together from staying due together
+    interval *= random.uniform(0.9, 1.1)
+    return max(CHECK_INTERVAL_MIN, min(CHECK_INTERVAL_MAX, interval))
+
+
+def reschedule(product, changed: bool, now: datetime) -> dict:
+    """Scheduling fields to store for `product` after a check at `now`."""
+    last_checked = product.checked_at or product.updated_at
+    volatility = update_volatility(product.volatility or 0.0, max(now - last_checked, timedelta()), changed)
+    last_changed = now if changed else (product.last_changed_at or product.updated_at)
+    interval = check_interval(volatility, product.watchers or 0, now - last_changed)
+    return {
+        "checked_at": now,
+        "next_check_at": now + interval,
+        "last_changed_at": last_changed,
+        "volatility": volatility,
+        "check_failures": 0,
+    }
+
+
+def reschedule_failed(product, now: datetime) -> dict:
+    """
+    Scheduling fields to store for `product` after a check at `now` that read
+    nothing. What was learned from earlier checks is kept and the product is
+    retried soon, backing off from CHECK_INTERVAL_MIN while it keeps failing.
+    """
+    failures = (product.check_failures or 0) + 1
+    interval = min(CHECK_INTERVAL_MAX, CHECK_INTERVAL_MIN * 2 ** min(failures - 1, 16))
+    return {
+        "next_check_at": now + interval * random.uniform(0.9, 1.1),
+        "check_failures": failures,
+    }
@@ -1,33 +1,113 @@
+import asyncio
 import logging
+import os
+import time
 from asyncio import TimeoutError
+from typing import Optional
+from aiohttp import ClientError
 
+from utils.cache import TTLCache
+from utils.metrics import EXTRACTIONS, SCRAPE_RETRIES, SCRAPE_SECONDS, extraction_result
+from utils.platforms import canonicalize
+from utils.resilience import RETRY_MAX_ATTEMPTS, RetryBudget, get_breaker, retry_delay
+from utils.scrapers.base import ProductInfo
 from utils.scrapers.flipkart import ExtractFlipkart
 from utils.scrapers.amazon import ExtractAmazon
-from utils.scrapers.generic import ExtractGeneric
+from utils.scrapers.generic import ExtractGeneric, SEARCH_URL
 
 logger = logging.getLogger(__name__)
 
+SCRAPE_CACHE_TTL = float(os.getenv("SCRAPE_CACHE_TTL", "600"))
+SCRAPE_CACHE_SIZE = int(os.getenv("SCRAPE_CACHE_SIZE", "2048"))
+
+# Keyed by canonical product key, only complete scrapes are kept
+scrape_cache = TTLCache(SCRAPE_CACHE_SIZE, SCRAPE_CACHE_TTL)
+
+EXTRACTORS = {
+    "amazon": lambda url, validators, code: ExtractAmazon(url, **validators),
+    "flipkart": lambda url, validators, code: ExtractFlipkart(url, **validators),
+    "generic": lambda url, validators, code: ExtractGeneric(url, code),
+}
+
+def __extractor_order(platform: str, extractor: Optional[str]) -> list[str]:
+    order = [platform, "generic"] if platform in EXTRACTORS and platform != "generic" else ["generic"]
+    # Start with the one that worked last time, the others stay as fallbacks
+    if extractor in order:
+        order.remove(extractor)
+        order.insert(0, extractor)
+    return order
+
+async def __extract(name: str, url: str, validators: dict, history_code: Optional[str], budget: Optional[RetryBudget]) -> Optional[ProductInfo]:
+    """
+    Runs one extractor behind its host's circuit breaker. Timeouts and
+    connection errors are retried with jittered backoff while the sweep's
+    retry budget lasts; an empty extraction counts as a failure but is not
+    retried, the page would come back the same. A product pricehistory.app
+    does not list is a healthy answer from it, not a failure.
+    """
+    breaker = get_breaker(SEARCH_URL if name == "generic" else url)
+    for attempt in range(RETRY_MAX_ATTEMPTS + 1):
+        if not breaker.allow():
+            EXTRACTIONS.labels(platform=name, result="circuit_open").inc()
+            return None
+        try:
+            async with EXTRACTORS[name](url, validators, history_code) as product:
+                if product.not_modified or (product.title and product.price):
+                    breaker.success()
+                    return product._replace(extractor=name)
+                if product.source == "unlisted":
+                    breaker.success()
+                    return None
+                breaker.failure("empty extraction")
+                return None
+        except (TimeoutError, ClientError) as e:
+            EXTRACTIONS.labels(platform=name, result="timeout" if isinstance(e, TimeoutError) else "connection_error").inc()
+            breaker.failure(type(e).__name__)
+        except Exception as e:
+            EXTRACTIONS.labels(platform=name, result="error").inc()
+            logger.error(e, exc_info=True)
+            breaker.failure(type(e).__name__)
+            return None
+
+        if attempt == RETRY_MAX_ATTEMPTS or budget is None or not budget.take():
+            return None
+        SCRAPE_RETRIES.labels(platform=name).inc()
+        await asyncio.sleep(retry_delay(attempt))
+    return None
+
+async def __fetch_product(url: str, platform: str, etag: Optional[str] = None, last_modified: Optional[str] = None, content_hash: Optional[str] = None,
+                          history_code: Optional[str] = None, extractor: Optional[str] = None, budget: Optional[RetryBudget] = None) -> ProductInfo:
+    validators = { "etag": etag, "last_modified": last_modified, "content_hash": content_hash }
+    for name in __extractor_order(platform, extractor):
+        if product := await __extract(name, url, validators, history_code, budget):
+            return product
+    return ProductInfo()
+
+async def scrape_product(url: str, platform: str, etag: Optional[str] = None, last_modified: Optional[str] = None, content_hash: Optional[str] = None,
+                         history_code: Optional[str] = None, extractor: Optional[str] = None, budget: Optional[RetryBudget] = None) -> ProductInfo:
+    """
+    Scrapes a product page, sending the stored validators so unchanged pages
+    come back with `not_modified` set instead of being parsed again. Each
+    extractor is tried at most once, the one that last succeeded first; the
+    result names the extractor that worked and the pricehistory.app code
+    it used, for the caller to store. Hosts whose circuit is open are skipped
+    and failed fetches are retried only out of `budget`, none without one.
+    Recent results are served from `scrape_cache` and concurrent scrapes of
+    the same product share one fetch.
+    """
+    started = time.perf_counter()
+    key = canonicalize(url).key
+    product = await scrape_cache.get_or_load(
+        key,
+        lambda: __fetch_product(url, platform, etag, last_modified, content_hash, history_code, extractor, budget),
+        cacheable=lambda product: bool(product.title and product.price),
+    )
+    if product.not_modified and not (etag or last_modified or content_hash):
+        # Joined a sweep's conditional fetch, but this caller needs the fields
+        product = await __fetch_product(url, platform, history_code=history_code, extractor=extractor)
+    SCRAPE_SECONDS.labels(platform=platform, result=extraction_result(product)).observe(time.perf_counter() - started)
+    return product
+
 async def scrape(url: str, platform: str):
-    try:
-        title, price = None, None
-        if platform == "flipkart":
-            async with ExtractFlipkart(url) as product:
-                title = product.get_title()
-                price = product.get_price()
-        elif platform == "amazon":
-            async with ExtractAmazon(url) as product:
-                title = product.get_title()
-                price = product.get_price()
-
-        if title and price:
-            return title, price
-        else:
-            async with ExtractGeneric(url) as product:
-                return product.get_title(), product.get_price()
-
-    except TimeoutError:
-        async with ExtractGeneric(url) as product:
-            return product.get_title(), product.get_price()
-    except Exception as e:
-        logger.error(e, exc_info=True)
-        return None, None
+    product = await scrape_product(url, platform)
+    return product.title, product.price
@@ -1,46 +1,61 @@
-from aiohttp import ClientSession, ClientTimeout
 from bs4 import BeautifulSoup as bs
 
+from utils.metrics import EXTRACTIONS, PARSE_SECONDS, record_extraction, timer
+from utils.parser_pool import run_parser
+from utils.scrapers.base import ProductInfo, checked_state, fetch_conditional
+from utils.scrapers.selectors import SelectorChain
+from utils.scrapers.structured import parse_structured
+
 REQUEST_HEADER = { "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:112.0) Gecko/20100101 Firefox/112.0" }
 REQUEST_COOKIES = { "cookies_are": "working" }
+PRICE_MARKERS = ('id="corePriceDisplay_desktop_feature_div"', 'id="corePrice_desktop"', 'id="priceblock_ourprice"')
+# Fallback selectors per field, current layouts first
+SELECTORS = {
+    "title": SelectorChain("div[id='titleSection'] > h1[id='title'] > span[id='productTitle']"),
+    "price": SelectorChain(
+        "div[id='corePriceDisplay_desktop_feature_div'] span.a-price.aok-align-center.reinventPricePriceToPayMargin.priceToPay > span:nth-child(2) > span.a-price-whole",
+        "div[id='corePrice_desktop']>div>table>span.a-offscreen",
+        "span[id='priceblock_ourprice']",
+    ),
+    "available": SelectorChain("input[id='add-to-cart-button']"),
+}
 
 class ExtractAmazon:
-    def __init__(self, url):
+    def __init__(self, url, etag=None, last_modified=None, content_hash=None):
         self.url = url
+        self.validators = { "etag": etag, "last_modified": last_modified, "content_hash": content_hash }
 
     async def __aenter__(self):
-        async with ClientSession(headers=REQUEST_HEADER, cookies=REQUEST_COOKIES, timeout=ClientTimeout(4)) as session:
-            async with session.get(self.url, allow_redirects=True) as req:
-                page = await req.text()
-                soup = bs(page, "lxml")
-                return AmazonPage(soup)
+        page, state = await fetch_conditional("amazon", self.url, REQUEST_HEADER, PRICE_MARKERS, cookies=REQUEST_COOKIES, **self.validators)
+        if page is None:
+            EXTRACTIONS.labels(platform="amazon", result="not_modified").inc()
+            return state
+        with timer(PARSE_SECONDS, platform="amazon"):
+            product = await run_parser(parse_amazon, page)
+        record_extraction("amazon", product)
+        return product._replace(**checked_state(page, PRICE_MARKERS, state, product.price))
     
     async def __aexit__(self, *args):
         pass
 
+def parse_amazon(page: str) -> ProductInfo:
+    if structured := parse_structured(page):
+        return structured
+    product = AmazonPage(bs(page, "lxml"))
+    return ProductInfo(product.get_title(), product.get_price(), product.is_available(), source="dom")
+
 class AmazonPage:
     def __init__(self, soup: bs):
         self.soup = soup
 
     # Function to extract Product Title
     def get_title(self):
-        title = self.soup.select_one("div[id='titleSection'] > h1[id='title'] > span[id='productTitle']")
-        return title.text.strip() if title else None
+        return SELECTORS["title"].text(self.soup)
 
     # Function to extract Product Price
     def get_price(self):
-        price = self.soup.select_one("span[id='priceblock_ourprice']")
-        if price:
-            price = price.text.strip()
-        else:
-            price_tag = self.soup.select_one("div[id='corePriceDisplay_desktop_feature_div'] span.a-price.aok-align-center.reinventPricePriceToPayMargin.priceToPay > span:nth-child(2) > span.a-price-whole")
-            if price_tag:
-                price = price_tag.text.strip()
-            else:
-                price_table = self.soup.select_one("div[id='corePrice_desktop']>div>table>span.a-offscreen")
-                price = price_table.text if price_table else None
-
-        return price.strip().replace(',','').replace('₹', '') if price else None
+        price = SELECTORS["price"].text(self.soup)
+        return price.replace(',','').replace('₹', '').strip() if price else None
 
     # Function to extract Product Rating
     def get_rating(self):
@@ -71,13 +86,7 @@ class AmazonPage:
 
     # Function to extract Availability Status
     def is_available(self):
-        try:
-            available = self.soup.find("input", attrs={'id':'add-to-cart-button'})
-            return bool(available)
-        
-        except AttributeError as e:
-            print('Exception: ', e)
-            return False	
+        return SELECTORS["available"].select_one(self.soup) is not None
         
     # Function to extract images 
     def get_images(self) -> list[str]:
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+from typing import NamedTuple, Optional
+from aiohttp import ClientResponse
+
+from utils.http import get_session
+from utils.metrics import FETCH_BYTES, FETCH_SECONDS, FETCH_TRUNCATED, timer
+from utils.throttle import host_slot
+
+# Pages are read in chunks and at most `cap` bytes of each are kept. With a
+# `tail`, reading also stops that many bytes past the first price marker,
+# which must leave room for the fields below the price and for region_hash.
+# Overridable via env as e.g. FETCH_CAP_AMAZON=4000000 / FETCH_TAIL_AMAZON=0
+FETCH_DEFAULTS = {
+    "amazon": { "cap": 3_000_000, "tail": 512_000 },
+    # Flipkart's JSON-LD sits below the price and its markers are too common to stop at
+    "flipkart": { "cap": 2_000_000, "tail": 0 },
+    "generic": { "cap": 1_000_000, "tail": 0 },
+}
+FETCH_STREAM = os.getenv("FETCH_STREAM", "1") != "0"
+FETCH_CHUNK_SIZE = int(os.getenv("FETCH_CHUNK_SIZE", "65536"))
+
+
+class ProductInfo(NamedTuple):
+    """Fields extracted from a product page, small enough to ship back from a parser worker."""
+    title: Optional[str] = None
+    price: Optional[str] = None
+    available: Optional[bool] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    # The page (or its price region) is unchanged since the validators were stored
+    not_modified: bool = False
+    # "structured" when read from meta tags or JSON-LD, "dom" when from
+    # selectors, "unlisted" when pricehistory.app does not know the product
+    source: Optional[str] = None
+    # Set by the scraper: the extractor that produced the fields, and the
+    # pricehistory.app code when that was the generic one
+    extractor: Optional[str] = None
+    history_code: Optional[str] = None
+
+    def fetch_state(self) -> dict:
+        return { "etag": self.etag, "last_modified": self.last_modified, "content_hash": self.content_hash }
+
+
+NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+REGION_SPAN = 4096
+
+
+def price_region(page: str, markers: tuple[str, ...], span: int = REGION_SPAN) -> Optional[str]:
+    """The slice of the page starting at the first price marker found."""
+    for marker in markers:
+        if (start := page.find(marker)) != -1:
+            return page[start:start + span]
+    return None
+
+
+def region_hash(page: str, markers: tuple[str, ...], span: int = REGION_SPAN) -> Optional[str]:
+    region = price_region(page, markers, span)
+    return hashlib.blake2b(region.encode(), digest_size=16).hexdigest() if region is not None else None
+
+
+def region_holds_price(page: str, markers: tuple[str, ...], price: Optional[str], span: int = REGION_SPAN) -> bool:
+    """Whether the extracted price is written, with or without separators, inside the hashed region."""
+    region = price_region(page, markers, span)
+    if region is None or not price:
+        return False
+    try:
+        value = float(price)
+    except ValueError:
+        return False
+    return any(float(number.replace(",", "")) == value for number in NUMBER.findall(region))
+
+
+def checked_state(page: str, markers: tuple[str, ...], state: ProductInfo, price: Optional[str]) -> dict:
+    """
+    Fetch state to store with a parsed product. The region hash is kept only
+    when the region holds the price, otherwise a price change outside it
+    would be skipped as unchanged.
+    """
+    fetch_state = state.fetch_state()
+    if fetch_state["content_hash"] and not region_holds_price(page, markers, price):
+        fetch_state["content_hash"] = None
+    return fetch_state
+
+
+def fetch_limit(platform: str) -> tuple[int, int]:
+    defaults = FETCH_DEFAULTS.get(platform, FETCH_DEFAULTS["generic"])
+    cap = int(os.getenv(f"FETCH_CAP_{platform.upper()}", defaults["cap"]))
+    tail = int(os.getenv(f"FETCH_TAIL_{platform.upper()}", defaults["tail"]))
+    return cap, tail
+
+
+async def read_page(res: ClientResponse, platform: str, markers: tuple[str, ...] = ()) -> str:
+    """
+    Reads a response body up to the platform's byte cap, stopping early past
+    the price markers, so a page never has to be buffered whole.
+    """
+    if not FETCH_STREAM:
+        body = await res.read()
+        FETCH_BYTES.labels(platform=platform).observe(len(body))
+        return body.decode(res.charset or "utf-8", errors="replace")
+
+    cap, tail = fetch_limit(platform)
+    encoded = [marker.encode() for marker in markers] if tail else []
+    overlap = max((len(marker) for marker in encoded), default=0)
+    stop_at = cap
+    body = bytearray()
+    async for chunk in res.content.iter_chunked(FETCH_CHUNK_SIZE):
+        start = max(len(body) - overlap, 0)
+        body += chunk
+        if encoded:
+            found = [pos for marker in encoded if (pos := body.find(marker, start)) != -1]
+            if found:
+                stop_at = min(cap, min(found) + tail)
+                encoded = []
+        if len(body) >= stop_at:
+            FETCH_TRUNCATED.labels(platform=platform, reason="cap" if stop_at == cap else "marker").inc()
+            del body[stop_at:]
+            if res.content.is_eof():
+                # Fully received (small compressed pages) and already back in the pool with
+                # reading paused on the full buffer; emptying it lets the connection read again
+                while await res.content.readany():
+                    pass
+            else:
+                # The rest is still on the wire, drop the connection instead of reading it
+                res.close()
+            break
+
+    FETCH_BYTES.labels(platform=platform).observe(len(body))
+    # A cut can split a multi-byte character, only that one is replaced
+    return body.decode(res.charset or "utf-8", errors="replace")
+
+
+async def fetch_conditional(platform: str, url: str, headers: dict, markers: tuple[str, ...], cookies: Optional[dict] = None,
+                            etag: Optional[str] = None, last_modified: Optional[str] = None, content_hash: Optional[str] = None) -> tuple[Optional[str], ProductInfo]:
+    """
+    Fetches a product page with the stored validators. Returns the page to
+    parse, or None with `not_modified` set when the server answered 304 or
+    the price region hashes to the stored value.
+    """
+    headers = dict(headers)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    session = await get_session()
+    with timer(FETCH_SECONDS, platform=platform):
+        async with host_slot(url) as slot, session.get(url, headers=headers, cookies=cookies, allow_redirects=True) as req:
+            slot.record(req.status)
+            if req.status == 304:
+                return None, ProductInfo(etag=etag, last_modified=last_modified, content_hash=content_hash, not_modified=True)
+            page = await read_page(req, platform, markers)
+            etag, last_modified = req.headers.get("ETag"), req.headers.get("Last-Modified")
+
+    page_hash = region_hash(page, markers)
+    state = ProductInfo(etag=etag, last_modified=last_modified, content_hash=page_hash)
+    if page_hash and page_hash == content_hash:
+        return None, state._replace(not_modified=True)
+    return page, state
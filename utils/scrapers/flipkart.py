@@ -1,44 +1,64 @@
 import re
-from aiohttp import ClientSession, ClientTimeout
 from bs4 import BeautifulSoup as bs
 
+from utils.metrics import EXTRACTIONS, PARSE_SECONDS, record_extraction, timer
+from utils.parser_pool import run_parser
+from utils.scrapers.base import ProductInfo, checked_state, fetch_conditional
+from utils.scrapers.selectors import SelectorChain
+from utils.scrapers.structured import parse_structured
+
 headers = {
     "Accept-Language": "en-IN;q=0.9,en;q=0.8",
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:112.0) Gecko/20100101 Firefox/112.0"
 }
+# Flipkart has no stable price ids, the embedded state and the first rupee sign sit next to the price
+PRICE_MARKERS = ('"pricing":', '₹')
+# Fallback selectors per field, the price block moves down a row on some layouts
+SELECTORS = {
+    "title": SelectorChain("h1>span"),
+    "price": SelectorChain(
+        "#container>div>div:nth-child(3)>div:nth-child(1)>div:nth-child(2)>div:nth-child(2)>div>div:nth-child(3)>div:nth-child(1)>div>div:nth-child(1)",
+        "#container>div>div:nth-child(3)>div:nth-child(1)>div:nth-child(2)>div:nth-child(2)>div>div:nth-child(4)>div>div>div:nth-child(1)",
+    ),
+    "sold_out": SelectorChain("#container>div>div:nth-child(3)>div:nth-child(1)>div:nth-child(2)>div:nth-child(3)>div:nth-child(1)"),
+}
 
 class ExtractFlipkart:
-    def __init__(self, url):
+    def __init__(self, url, etag=None, last_modified=None, content_hash=None):
         self.url = url
+        self.validators = { "etag": etag, "last_modified": last_modified, "content_hash": content_hash }
 
     async def __aenter__(self):
-        async with ClientSession(headers=headers, timeout=ClientTimeout(4)) as session:
-            async with session.get(self.url, allow_redirects=True) as req:
-                page = await req.text()
-                soup = bs(page, "lxml")
-                return FlipkartPage(soup)
+        page, state = await fetch_conditional("flipkart", self.url, headers, PRICE_MARKERS, **self.validators)
+        if page is None:
+            EXTRACTIONS.labels(platform="flipkart", result="not_modified").inc()
+            return state
+        with timer(PARSE_SECONDS, platform="flipkart"):
+            product = await run_parser(parse_flipkart, page)
+        record_extraction("flipkart", product)
+        return product._replace(**checked_state(page, PRICE_MARKERS, state, product.price))
 
     async def __aexit__(self, *args):
         pass
 
+def parse_flipkart(page: str) -> ProductInfo:
+    if structured := parse_structured(page):
+        return structured
+    product = FlipkartPage(bs(page, "lxml"))
+    return ProductInfo(product.get_title(), product.get_price(), product.is_available(), source="dom")
+
 class FlipkartPage:
     def __init__(self, soup: bs):
         self.soup = soup
     
     # Function to extract Product Title
     def get_title(self):
-        title = self.soup.select_one("h1>span")
+        title = SELECTORS["title"].select_one(self.soup)
         return re.sub("   +", " ", title.text) if title else None
 
     # Function to extract Product Price
     def get_price(self):
-        price = self.soup.select_one('#container>div>div:nth-child(3)>div:nth-child(1)>div:nth-child(2)>div:nth-child(2)>div>div:nth-child(3)>div:nth-child(1)>div>div:nth-child(1)')
-        price = price.text.strip() if price else None
-        
-        if not price:
-            price = self.soup.select_one('#container>div>div:nth-child(3)>div:nth-child(1)>div:nth-child(2)>div:nth-child(2)>div>div:nth-child(4)>div>div>div:nth-child(1)')
-            price = price.text.strip() if price else None
-        
+        price = SELECTORS["price"].text(self.soup)
         return price.replace('₹', '').replace(',', '') if price else None
 
     # Function to extract Product Rating
@@ -53,16 +73,7 @@ class FlipkartPage:
 
     # Function to extract Availability Status
     def is_available(self):
-        try:
-            sold_out = self.soup.select_one('#container>div>div:nth-child(3)>div:nth-child(1)>div:nth-child(2)>div:nth-child(3)>div:nth-child(1)')
-            if sold_out:
-                sold_out = sold_out.text.strip()
-                return sold_out != 'Sold Out'
-            else:
-                return True
-        except AttributeError as e:
-            print(e)
-            return True	
+        return SELECTORS["sold_out"].text(self.soup) != 'Sold Out'
     
 
     # Function to extract images [ul>li>div>div>img]
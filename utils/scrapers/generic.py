@@ -1,55 +1,84 @@
-from typing import Union
-from aiohttp import ClientSession, ClientTimeout
+from typing import Optional, Union
+from aiohttp import ClientSession
 from bs4 import BeautifulSoup as bs
 
+from utils.http import get_session
+from utils.metrics import EXTRACTIONS, FETCH_SECONDS, PARSE_SECONDS, record_extraction, timer
+from utils.parser_pool import run_parser
+from utils.scrapers.base import ProductInfo, read_page
+from utils.scrapers.selectors import SelectorChain
+from utils.scrapers.structured import parse_structured
+from utils.throttle import host_slot
+
 REQUEST_HEADER = { "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36" }
+SEARCH_URL = "https://pricehistory.app/api/search"
+SELECTORS = {
+    "title": SelectorChain("div#product-info > div > div > table > tbody > tr:-soup-contains('Product Name') > td"),
+    "price": SelectorChain("div#price-table > div > table > tbody > tr:-soup-contains('Price') > td"),
+}
 
 class ExtractGeneric:
-    def __init__(self, url):
+    """
+    Reads the product from its pricehistory.app page. A stored `code` skips
+    the search call; it is searched again only when its page is gone.
+    """
+    def __init__(self, url, code=None):
         self.url = url
+        self.code = code
+
+    async def search(self, session: ClientSession) -> Optional[str]:
+        data: dict[str, Union[bool, str]] = { "status": False, "code": "" }
+        async with host_slot(SEARCH_URL) as slot, session.post(SEARCH_URL, headers=REQUEST_HEADER, data={"url": self.url}) as res:
+            slot.record(res.status)
+            data = await res.json()
+        return str(data["code"]) if data and data["status"] else None
+
+    async def fetch(self, session: ClientSession, code: str) -> Optional[str]:
+        page_url = "https://pricehistory.app/p/" + code
+        with timer(FETCH_SECONDS, platform="generic"):
+            async with host_slot(page_url) as slot, session.get(page_url, headers=REQUEST_HEADER, allow_redirects=True) as req:
+                slot.record(req.status)
+                if req.status == 404:
+                    return None
+                return await read_page(req, "generic")
 
     async def __aenter__(self):
-        async with ClientSession(headers=REQUEST_HEADER, timeout=ClientTimeout(4)) as session:
-            data: dict[str, Union[bool, str]] = { "status": False, "code": "" }
-            async with session.post("https://pricehistory.app/api/search", data={"url": self.url}) as res:
-                data = await res.json()
+        session = await get_session()
+        code, page = self.code, None
+        if code:
+            page = await self.fetch(session, code)
+        if page is None and (code := await self.search(session)):
+            page = await self.fetch(session, code)
 
-            if data and data["status"]:
-                async with session.get("https://pricehistory.app/p/" + str(data["code"]), allow_redirects=True) as req:
-                    page = await req.text()
-                    soup = bs(page, "lxml")
-                    return CommonPage(soup)
-            else:
-                soup = bs("", "lxml")
-                return CommonPage(soup)
+        if page is None:
+            EXTRACTIONS.labels(platform="generic", result="unlisted").inc()
+            return ProductInfo(source="unlisted")
+        with timer(PARSE_SECONDS, platform="generic"):
+            product = await run_parser(parse_generic, page)
+        record_extraction("generic", product)
+        return product._replace(history_code=code)
     
     async def __aexit__(self, *args):
         pass
 
+def parse_generic(page: str) -> ProductInfo:
+    if structured := parse_structured(page):
+        return structured
+    product = CommonPage(bs(page, "lxml"))
+    return ProductInfo(product.get_title(), product.get_price(), source="dom")
+
 class CommonPage:
     def __init__(self, soup: bs):
         self.soup = soup
 
     # Function to extract Product Title
     def get_title(self):
-        try:
-            title = self.soup.select_one("div#product-info > div > div > table > tbody > tr:-soup-contains('Product Name') > td")
-            title_string = title.text.strip() if title else ''
-
-        except AttributeError as e:
-            title_string = ""	
-            
-        return title_string
+        return SELECTORS["title"].text(self.soup) or ''
 
     # Function to extract Product Price
     def get_price(self):
-        price = self.soup.select_one("div#price-table > div > table > tbody > tr:-soup-contains('Price') > td")
-        if price:
-            price = price.text.strip()
-        else:
-            price = ''
-
-        return price.strip().replace(',','').replace('₹', '')
+        price = SELECTORS["price"].text(self.soup) or ''
+        return price.replace(',','').replace('₹', '')
 
     # Function to extract Product Rating
     def get_rating(self):
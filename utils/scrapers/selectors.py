@@ -0,0 +1,45 @@
+from typing import Optional
+import soupsieve
+from bs4 import BeautifulSoup as bs, Tag
+
+
+class SelectorChain:
+    """
+    Fallback CSS selectors for one field, compiled once at import. Every match
+    counts as a hit for its selector and a selector moves ahead of the one
+    before it once it has more hits, so on a typical page the first selector
+    tried is the one that matches.
+    """
+    def __init__(self, *selectors: str):
+        self._initial = (list(selectors), [soupsieve.compile(selector) for selector in selectors])
+        self.reset()
+
+    def reset(self):
+        """Back to the declared order with no hits."""
+        self.patterns, self.selectors = list(self._initial[0]), list(self._initial[1])
+        self.hits = [0] * len(self.patterns)
+
+    def select_one(self, soup: bs) -> Optional[Tag]:
+        for i, selector in enumerate(self.selectors):
+            if (tag := selector.select_one(soup)) is not None:
+                self._hit(i)
+                return tag
+        return None
+
+    def text(self, soup: bs) -> Optional[str]:
+        """Stripped text of the first selector matching a non-empty element."""
+        for i, selector in enumerate(self.selectors):
+            tag = selector.select_one(soup)
+            if tag is not None and (text := tag.text.strip()):
+                self._hit(i)
+                return text
+        return None
+
+    def _hit(self, i: int):
+        self.hits[i] += 1
+        if i and self.hits[i] > self.hits[i - 1]:
+            for items in (self.patterns, self.selectors, self.hits):
+                items[i - 1], items[i] = items[i], items[i - 1]
+
+    def stats(self) -> list[tuple[str, int]]:
+        return list(zip(self.patterns, self.hits))
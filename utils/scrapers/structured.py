@@ -0,0 +1,89 @@
+import html
+import json
+import re
+from typing import Optional
+
+from utils.scrapers.base import ProductInfo
+
+LD_JSON = re.compile(r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.I | re.S)
+META_TAG = re.compile(r'<meta\s[^>]*>', re.I)
+META_ATTR = re.compile(r'(property|name|content)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.I)
+
+TITLE_META = ("og:title", "twitter:title")
+PRICE_META = ("product:price:amount", "og:price:amount")
+AVAILABILITY_META = ("product:availability", "og:availability")
+
+
+def clean_price(price) -> Optional[str]:
+    if price is None:
+        return None
+    price = str(price).replace(',', '').replace('₹', '').strip()
+    try:
+        float(price)
+    except ValueError:
+        return None
+    return price
+
+
+def is_available(availability) -> Optional[bool]:
+    if not availability:
+        return None
+    availability = str(availability).rsplit('/', 1)[-1].replace(' ', '').replace('_', '').lower()
+    return availability in ("instock", "limitedavailability", "onlineonly", "presale", "preorder")
+
+
+def from_meta(head: str) -> ProductInfo:
+    values: dict[str, str] = {}
+    for tag in META_TAG.findall(head):
+        attrs = { name.lower(): double or single for name, double, single in META_ATTR.findall(tag) }
+        key = attrs.get("property") or attrs.get("name")
+        if key and "content" in attrs:
+            values.setdefault(key.lower(), html.unescape(attrs["content"]))
+
+    title = next((values[key] for key in TITLE_META if values.get(key)), None)
+    price = next((price for key in PRICE_META if (price := clean_price(values.get(key)))), None)
+    available = next((is_available(values[key]) for key in AVAILABILITY_META if values.get(key)), None)
+    return ProductInfo(title, price, available)
+
+
+def ld_products(data):
+    """Yields the schema.org Product nodes of a JSON-LD document."""
+    if isinstance(data, list):
+        for item in data:
+            yield from ld_products(item)
+    elif isinstance(data, dict):
+        kind = data.get("@type")
+        if kind == "Product" or (isinstance(kind, list) and "Product" in kind):
+            yield data
+        yield from ld_products(data.get("@graph"))
+
+
+def from_ld_json(product: dict) -> ProductInfo:
+    offers = product.get("offers")
+    offer = (offers[0] if offers else {}) if isinstance(offers, list) else (offers or {})
+    price = clean_price(offer.get("price", offer.get("lowPrice")))
+    title = product.get("name")
+    return ProductInfo(html.unescape(title.strip()) if isinstance(title, str) else None, price, is_available(offer.get("availability")))
+
+
+def parse_structured(page: str) -> Optional[ProductInfo]:
+    """
+    Reads the title and price from the page's meta tags or JSON-LD without
+    building a DOM, stopping at the first complete product. Returns None when
+    neither carries both, the caller then falls back to its selectors.
+    """
+    head_end = page.find("</head>")
+    product = from_meta(page[:head_end] if head_end != -1 else page)
+    if product.title and product.price:
+        return product._replace(source="structured")
+
+    for match in LD_JSON.finditer(page):
+        try:
+            data = json.loads(match.group(1))
+        except ValueError:
+            continue
+        for node in ld_products(data):
+            found = from_ld_json(node)
+            if found.title and found.price:
+                return found._replace(source="structured")
+    return None
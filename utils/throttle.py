@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = (429, 503)
+
+# Per-host starting rate (requests per second) and concurrency, overridable via
+# env as e.g. HOST_RATE_AMAZON_IN=2 / HOST_CONCURRENCY_AMAZON_IN=4
+HOST_DEFAULTS = {
+    "amazon.in": { "rate": 2.0, "concurrency": 4 },
+    "amazon.com": { "rate": 1.0, "concurrency": 2 },
+    "flipkart.com": { "rate": 3.0, "concurrency": 6 },
+    "pricehistory.app": { "rate": 1.0, "concurrency": 2 },
+}
+DEFAULT_RATE = float(os.getenv("HOST_RATE_DEFAULT", "1"))
+DEFAULT_CONCURRENCY = int(os.getenv("HOST_CONCURRENCY_DEFAULT", "2"))
+MIN_RATE = float(os.getenv("HOST_RATE_MIN", "0.1"))
+RATE_CEILING = float(os.getenv("HOST_RATE_CEILING", "4"))
+# Requests per second a host's rate regains with every healthy response
+RATE_STEP = float(os.getenv("HOST_RATE_STEP", "0.1"))
+# Requests in flight at once across all hosts. Taken only once a request's
+# host has let it through, so a throttled host never holds the slots that
+# requests to healthy hosts are waiting for (SWEEP_CONCURRENCY is the old name)
+TOTAL_CONCURRENCY = int(os.getenv("HOST_CONCURRENCY_TOTAL", os.getenv("SWEEP_CONCURRENCY", "16")))
+
+__in_flight: Optional[asyncio.Semaphore] = None
+
+
+def _in_flight() -> asyncio.Semaphore:
+    # Created on first use, inside the running event loop
+    global __in_flight
+    if __in_flight is None:
+        __in_flight = asyncio.Semaphore(TOTAL_CONCURRENCY)
+    return __in_flight
+
+
+class HostLimiter:
+    """
+    Paces requests to a single host and adapts the pace to its responses:
+    the rate is halved on 429/503 or timeouts and grows back by RATE_STEP
+    per healthy response (AIMD). Once paced, a request also takes one of
+    the TOTAL_CONCURRENCY slots shared by all hosts.
+    """
+    def __init__(self, host: str, rate: float, concurrency: int, max_rate: float):
+        self.host = host
+        self.rate = rate
+        self.max_rate = max(max_rate, rate)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        await self._semaphore.acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            async with self._lock:
+                now = loop.time()
+                delay = self._next_slot - now
+                self._next_slot = max(now, self._next_slot) + 1 / self.rate
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await _in_flight().acquire()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def release(self):
+        _in_flight().release()
+        self._semaphore.release()
+
+    def success(self):
+        self.rate = min(self.max_rate, self.rate + RATE_STEP)
+
+    def backoff(self, reason: str):
+        rate = max(MIN_RATE, self.rate / 2)
+        if rate != self.rate:
+            logger.warning(f"Backing off {self.host} to {rate:.2f} req/s ({reason})")
+        self.rate = rate
+        # Push the next slot out so requests already queued feel the new pace
+        self._next_slot = max(self._next_slot, asyncio.get_running_loop().time() + 1 / rate)
+
+    def record(self, status: int):
+        if status in THROTTLE_STATUSES:
+            self.backoff(f"HTTP {status}")
+        else:
+            self.success()
+
+
+class HostSlot:
+    """
+    Async context manager holding one request slot for a host. Call
+    `record(status)` with the response status; timeouts raised inside the
+    block are recorded as back-off signals automatically.
+    """
+    def __init__(self, limiter: HostLimiter):
+        self.limiter = limiter
+        self._recorded = False
+
+    def record(self, status: int):
+        self._recorded = True
+        self.limiter.record(status)
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is not None and issubclass(exc_type, asyncio.TimeoutError):
+                self.limiter.backoff("timeout")
+            elif exc_type is None and not self._recorded:
+                self.limiter.success()
+        finally:
+            self.limiter.release()
+
+
+__limiters: dict[str, HostLimiter] = {}
+
+
+def host_key(url: str) -> str:
+    host = (urlsplit(url).hostname or "").lower()
+    for domain in HOST_DEFAULTS:
+        if host == domain or host.endswith("." + domain):
+            return domain
+    return host
+
+
+def _env_name(prefix: str, host: str) -> str:
+    return prefix + host.upper().replace(".", "_").replace("-", "_")
+
+
+def get_limiter(url: str) -> HostLimiter:
+    key = host_key(url)
+    limiter: Optional[HostLimiter] = __limiters.get(key)
+    if limiter is None:
+        defaults = HOST_DEFAULTS.get(key, {})
+        rate = float(os.getenv(_env_name("HOST_RATE_", key), defaults.get("rate", DEFAULT_RATE)))
+        concurrency = int(os.getenv(_env_name("HOST_CONCURRENCY_", key), defaults.get("concurrency", DEFAULT_CONCURRENCY)))
+        limiter = __limiters[key] = HostLimiter(key, rate, concurrency, RATE_CEILING)
+    return limiter
+
+
+def host_slot(url: str) -> HostSlot:
+    return HostSlot(get_limiter(url))
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+from dotenv import load_dotenv
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+async def work(worker_id: str, idle_seconds: float, once: bool):
+    from bot import bot
+    from bot.scheduler import run_sweep
+    from utils.db import connect, disconnect
+    from utils.http import start_http, close_http
+
+    await connect()
+    await start_http()
+    try:
+        while True:
+            checked = await run_sweep(worker_id)
+            if once:
+                break
+            if not checked:
+                await asyncio.sleep(idle_seconds)
+    finally:
+        await close_http()
+        await bot.session.close()
+        await disconnect()
+
+def start(index: int, idle_seconds: float, once: bool, metrics_port: int):
+    # Workers already spread over the cores, parsing in each one stays inline
+    os.environ.setdefault("PARSER_POOL", "inline")
+    if metrics_port:
+        from prometheus_client import start_http_server
+        # One port per process, each worker keeps its own registry
+        start_http_server(metrics_port + index)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    try:
+        asyncio.run(work(worker_id, idle_seconds, once))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Standalone price sweep workers sharing due products through leases")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to start on this node")
+    parser.add_argument("--idle", type=float, default=60, help="Seconds to wait when no product is due")
+    parser.add_argument("--once", action="store_true", help="Exit after a single pass over the due products")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics from this port on, one per process")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        start(0, args.idle, args.once, args.metrics_port)
+    else:
+        workers = [multiprocessing.Process(target=start, args=(i, args.idle, args.once, args.metrics_port)) for i in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()